@@ -8,13 +8,23 @@ import requests
 import json
 import re
 import binascii
+import io
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from dotenv import load_dotenv
 
 # 引入工具类
 try:
-    from utils.vector_store import MilvusVectorStore
+    from utils.vector_store import MilvusVectorStore, remove_keyword_index, remove_ingest_journal, bump_collection_version, INDEX_PRESETS
+    from utils.ingest_journal import file_sha256, chunk_hash, STAGE_EMBEDDED, STAGE_INSERTED
     from utils.ernie_client import ERNIEClient
     from utils.reranker_v2 import RerankerAndFilterV2
+    from utils.cross_encoder import load_cross_encoder_from_env
+    from utils.lru_cache import LRUCache
+    from utils.answer_cache import SemanticAnswerCache
+    from utils.ingest_pipeline import IngestPipeline, PipelineStage
+    from utils.image_downloader import ImageDownloader
 except ImportError as e:
     print(f"❌ 导入工具类失败: {e}")
     # 为了防止报错导致程序崩溃，这里可以做个软处理或直接退出
@@ -23,6 +33,12 @@ except ImportError as e:
 from pymilvus import utility, connections
 import gradio as gr
 
+# 可选依赖: 用于按页拆分 PDF 分批上传，未安装时整份上传
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:
+    PdfReader = PdfWriter = None
+
 load_dotenv()
 def on_gallery_select(evt: gr.SelectData, collection_name, doc_filename):
     """
@@ -111,14 +127,158 @@ reranker_filter = None
 known_collections = {}
 system_ready = False
 
+# === 查询预处理: 双语翻译缓存 + 与向量化并行执行 ===
+TRANSLATE_TIMEOUT = 10  # 翻译超时后直接用原问题检索，不阻塞问答
+translation_cache = LRUCache(maxsize=1024)
+query_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="query")
+
+# === 语义答案缓存: 同一知识库 + 文件过滤下的相同/近义问题直接返回缓存回答，知识库有插入/删除后自动失效 ===
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))  # 设为 0 关闭
+answer_cache = SemanticAnswerCache(
+    maxsize=ANSWER_CACHE_SIZE,
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+) if ANSWER_CACHE_SIZE > 0 else None
+
+# 自适应候选深度检索 (只为最终候选回表取正文)，设为 0 时退回固定深度
+ADAPTIVE_RETRIEVAL = os.getenv("ADAPTIVE_RETRIEVAL", "1") != "0"
+# 两阶段检索：融合后只为前 N 个候选取正文送入重排，其余候选不回表
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "80"))
+
+# === 入库流水线: OCR -> 切分(含图片) -> 向量化 -> 写入，各阶段并发度与队列长度 ===
+OCR_WORKERS = 2
+EMBED_WORKERS = 2
+EMBED_GROUP_SIZE = 64  # 每组送入向量化阶段的片段数
+PIPELINE_QUEUE_SIZE = 4
+
+# === 在线解析: 大 PDF 按页拆分后分批并发上传 (需要 pypdf) ===
+OCR_PAGES_PER_BATCH = int(os.getenv("OCR_PAGES_PER_BATCH", "10"))  # 0 表示不拆分
+OCR_UPLOAD_WORKERS = int(os.getenv("OCR_UPLOAD_WORKERS", "3"))
+OCR_BATCH_RETRIES = int(os.getenv("OCR_BATCH_RETRIES", "2"))
+OCR_IMAGE_WORKERS = int(os.getenv("OCR_IMAGE_WORKERS", "8"))
+
+# 全进程共享一个图片下载器 (连接池跨上传复用，不会每次上传新建一个 Session 而不关闭)
+_image_downloader = None
+_image_downloader_lock = threading.Lock()
+
+def shared_image_downloader():
+    global _image_downloader
+    with _image_downloader_lock:
+        if _image_downloader is None:
+            _image_downloader = ImageDownloader(max_workers=OCR_IMAGE_WORKERS)
+        return _image_downloader
+
 # === 核心类: 在线 PDF 解析器 ===
 class OnlinePDFParser:
     """处理云端 API 调用"""
-    def __init__(self, api_url, token):
+    def __init__(self, api_url, token, image_downloader=None, pages_per_batch=None, upload_workers=None, batch_retries=None):
         self.api_url = api_url
         self.token = token
+        self.image_downloader = image_downloader or shared_image_downloader()
+        self.pages_per_batch = OCR_PAGES_PER_BATCH if pages_per_batch is None else int(pages_per_batch)
+        self.upload_workers = max(1, OCR_UPLOAD_WORKERS if upload_workers is None else int(upload_workers))
+        self.batch_retries = max(0, OCR_BATCH_RETRIES if batch_retries is None else int(batch_retries))
+        self._pdf_lock = threading.Lock()
+
+    def _request_layout(self, file_data, file_type):
+        """发送一次版面解析请求，返回 (layoutParsingResults, 错误信息)"""
+        payload = {
+            "file": file_data,
+            "fileType": file_type,
+            "useDocOrientationClassify": False,
+            "useDocUnwarping": False,
+            "useTextlineOrientation": False,
+            "useChartRecognition": False,
+        }
+
+        headers = {
+            "Authorization": f"token {self.token}",
+            "Content-Type": "application/json"
+        }
+
+        # 大文件上传需要较长时间，超时设为 600秒
+        response = requests.post(self.api_url, json=payload, headers=headers, timeout=600)
+
+        if response.status_code != 200:
+            print(f"❌ [API Error] HTTP {response.status_code}: {response.text[:100]}")
+            return None, f"API HTTP错误 ({response.status_code})"
+
+        res_json = response.json()
+
+        if "errorCode" in res_json and res_json["errorCode"]:
+            err_msg = res_json.get('errorMsg', '未知错误')
+            print(f"❌ [API Error] 业务错误: {err_msg}")
+            return None, f"API 业务错误: {err_msg}"
 
-    def predict(self, file_path):
+        api_result = res_json.get("result", {})
+        parsing_results = api_result.get("layoutParsingResults", []) if isinstance(api_result, dict) else []
+
+        if not parsing_results:
+            if isinstance(api_result, list):
+                return None, "⚠️ 检测到纯 OCR 接口返回，本系统需要 Layout Parsing 结构。"
+            print(f"⚠️ [API Warning] layoutParsingResults 为空。Keys: {list(res_json.keys())}")
+            return None, "API 返回结果为空 (可能文件无法解析)"
+        return parsing_results, None
+
+    def _page_batches(self, file_path, start_page=0):
+        """返回从 start_page 开始的 [(起始页, 结束页)]，文件不需要/无法拆分时返回 None"""
+        if self.pages_per_batch <= 0 or PdfReader is None: return None
+        try:
+            n_pages = len(PdfReader(file_path).pages)
+        except Exception as e:
+            print(f"⚠️ PDF 页数读取失败，整份上传: {e}")
+            return None
+        if n_pages <= self.pages_per_batch and start_page == 0: return None
+        return [(start, min(start + self.pages_per_batch, n_pages)) for start in range(start_page, n_pages, self.pages_per_batch)] or None
+
+    def _request_page_batch(self, reader, start, end):
+        """上传 [start, end) 页，失败时按指数退避重试本批次"""
+        # 只在发送前生成本批次的 PDF，内存中同时存在的只有并发中的几个批次
+        with self._pdf_lock:
+            writer = PdfWriter()
+            for page_no in range(start, end):
+                writer.add_page(reader.pages[page_no])
+            buf = io.BytesIO()
+            writer.write(buf)
+        file_data = base64.b64encode(buf.getvalue()).decode("ascii")
+        del buf
+
+        err = None
+        for attempt in range(self.batch_retries + 1):
+            try:
+                results, err = self._request_layout(file_data, 0)
+            except Exception as e:
+                results, err = None, f"请求异常: {e}"
+            if results is not None:
+                return results, None
+            if attempt < self.batch_retries:
+                wait = 2 ** attempt
+                print(f"   ↳ ⚠️ 第 {start + 1}-{end} 页解析失败 ({err})，{wait}s 后重试 ({attempt + 1}/{self.batch_retries})")
+                time.sleep(wait)
+        return None, err
+
+    def _predict_in_batches(self, file_path, batches):
+        """分批并发上传，结果按页序合并；任一批次重试后仍失败则整体失败"""
+        print(f"   ↳ 按页拆分上传: {len(batches)} 批 (每批 {self.pages_per_batch} 页, 并发 {self.upload_workers})")
+        reader = PdfReader(file_path)
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=min(self.upload_workers, len(batches)), thread_name_prefix="ocr_upload") as pool:
+            futures = [pool.submit(self._request_page_batch, reader, start, end) for start, end in batches]
+            outcomes = [f.result() for f in futures]
+
+        merged = []
+        for (start, end), (results, err) in zip(batches, outcomes):
+            if results is None:
+                return None, f"第 {start + 1}-{end} 页解析失败: {err}"
+            merged.extend(results)
+        print(f"   ↳ 分批解析完成: {len(merged)} 页, 耗时 {time.time() - start_time:.1f}s")
+        return merged, None
+
+    def predict(self, file_path, asset_dir=None, start_page=0):
+        """
+        asset_dir 不为空时，图片边下载边写入该目录，结果中只携带图片路径；否则以 Base64 形式保存在内存中
+        start_page > 0 (断点续传) 且可按页拆分时只解析之后的页，之前的页在结果中为 None
+        """
         if not self.token:
             return None, "❌ 错误: 未配置 Token"
         if not self.api_url:
@@ -128,50 +288,21 @@ class OnlinePDFParser:
         print(f"☁️ [Online] 正在请求在线 OCR API: {file_name}")
         
         try:
-            with open(file_path, "rb") as file:
-                file_bytes = file.read()
-                file_data = base64.b64encode(file_bytes).decode("ascii")
-
             # 简单判断文件类型
             ext = os.path.splitext(file_name)[1].lower()
             file_type = 0 if ext == '.pdf' else 1 
-            
-            payload = {
-                "file": file_data,
-                "fileType": file_type,
-                "useDocOrientationClassify": False,
-                "useDocUnwarping": False,
-                "useTextlineOrientation": False,
-                "useChartRecognition": False,
-            }
-            
-            headers = {
-                "Authorization": f"token {self.token}", 
-                "Content-Type": "application/json"
-            }
-            
-            # 大文件上传需要较长时间，超时设为 600秒
-            response = requests.post(self.api_url, json=payload, headers=headers, timeout=600)
-            
-            if response.status_code != 200:
-                print(f"❌ [API Error] HTTP {response.status_code}: {response.text[:100]}")
-                return None, f"API HTTP错误 ({response.status_code})"
-            
-            res_json = response.json()
-            
-            if "errorCode" in res_json and res_json["errorCode"]:
-                err_msg = res_json.get('errorMsg', '未知错误')
-                print(f"❌ [API Error] 业务错误: {err_msg}")
-                return None, f"API 业务错误: {err_msg}"
 
-            api_result = res_json.get("result", {})
-            parsing_results = api_result.get("layoutParsingResults", [])
-            
-            if not parsing_results:
-                if isinstance(api_result, list):
-                     return None, "⚠️ 检测到纯 OCR 接口返回，本系统需要 Layout Parsing 结构。"
-                print(f"⚠️ [API Warning] layoutParsingResults 为空。Keys: {list(res_json.keys())}")
-                return None, "API 返回结果为空 (可能文件无法解析)"
+            batches = self._page_batches(file_path, start_page) if file_type == 0 else None
+            page_offset = batches[0][0] if batches else 0
+            if batches:
+                parsing_results, err = self._predict_in_batches(file_path, batches)
+            else:
+                with open(file_path, "rb") as file:
+                    file_data = base64.b64encode(file.read()).decode("ascii")
+                parsing_results, err = self._request_layout(file_data, file_type)
+                del file_data
+            if parsing_results is None:
+                return None, err
 
             class MockResult:
                 def __init__(self, md_text, imgs):
@@ -180,33 +311,49 @@ class OnlinePDFParser:
                         'markdown_images': imgs
                     }
 
-            mock_outputs = []
+            # 处理图片下载：整份文档的图片并发下载 (连接池复用 + 失败重试)
+            image_tasks = []
+            for i, item in enumerate(parsing_results, start=page_offset):
+                for img_key, img_url in item.get("markdown", {}).get("images", {}).items():
+                    if asset_dir:
+                        image_tasks.append(((i, img_key), img_url, os.path.join(asset_dir, make_image_filename(i, img_key))))
+                    else:
+                        image_tasks.append(((i, img_key), img_url))
+            if image_tasks:
+                print(f"   ↳ 正在并发下载 {len(image_tasks)} 张图片...")
+            downloaded, report = self.image_downloader.download_many(image_tasks)
+            if image_tasks:
+                print(f"   ↳ 图片下载完成: {report['ok']}/{report['count']} 张, {report['bytes'] / 1024:.0f} KB, "
+                      f"耗时 {report['seconds']:.1f}s (p50 {report['p50_ms']:.0f}ms / max {report['max_ms']:.0f}ms)"
+                      + (f", 失败 {report['failed']} 张" if report['failed'] else ""))
+
+            mock_outputs = [None] * page_offset
             
-            for i, item in enumerate(parsing_results):
+            for i, item in enumerate(parsing_results, start=page_offset):
                 md_data = item.get("markdown", {})
                 raw_text = md_data.get("text", "")
-                
-                # 处理图片下载
-                image_urls = md_data.get("images", {})
                 processed_images = {}
-                
-                if image_urls:
-                    print(f"   ↳ 正在下载第 {i+1} 部分的 {len(image_urls)} 张图片...")
-                    for img_key, img_url in image_urls.items():
-                        try:
-                            img_resp = requests.get(img_url, timeout=30)
-                            if img_resp.status_code == 200:
-                                b64_str = base64.b64encode(img_resp.content).decode('utf-8')
-                                processed_images[img_key] = b64_str
-                        except Exception as e: pass
+                for img_key in md_data.get("images", {}):
+                    content = downloaded.get((i, img_key))
+                    if content is None: continue
+                    # 已落盘时保存的是路径，否则为 Base64
+                    processed_images[img_key] = content if asset_dir else base64.b64encode(content).decode('utf-8')
                 
                 mock_outputs.append(MockResult(raw_text, processed_images))
             
+            self.last_image_report = report
             return mock_outputs, "Success"
 
         except Exception as e:
             return None, f"请求异常: {str(e)}"
 
+def make_image_filename(page_idx, img_key):
+    """图片在 assets 下的文件名 (格式: p0_123456_name.jpg)"""
+    base_name = os.path.basename(img_key)
+    sname = f"p{page_idx}_{int(time.time())}_{base_name}"
+    if not sname.endswith(('.jpg', '.png')): sname += ".jpg"
+    return sname
+
 # === 文本处理工具 ===
 def split_text_into_chunks(text: str, chunk_size: int = 300, overlap: int = 120) -> list:
     if not text: return []
@@ -236,6 +383,43 @@ def split_text_into_chunks(text: str, chunk_size: int = 300, overlap: int = 120)
         if content: chunks.append(content)
     return chunks
 
+def save_page_images(page_idx, page_text, page_images, file_img_dir):
+    """把页内图片保存到 assets (已落盘的只替换引用)，返回替换为 [图表: 文件名] 后的页面文本"""
+    for img_path_key, img_val in page_images.items():
+        try:
+            if isinstance(img_val, str) and os.path.isfile(img_val):
+                # 解析阶段已直接写入 assets，只需替换文本中的引用
+                page_text = page_text.replace(img_path_key, f"[图表: {os.path.basename(img_val)}]")
+                continue
+
+            sname = make_image_filename(page_idx, img_path_key)
+            spath = os.path.join(file_img_dir, sname)
+
+            if isinstance(img_val, str):
+                with open(spath, "wb") as f: f.write(base64.b64decode(img_val))
+            elif hasattr(img_val, 'save'):
+                img_val.save(spath)
+            
+            page_text = page_text.replace(img_path_key, f"[图表: {sname}]")
+        except Exception as e: pass
+    return page_text
+
+def build_page_docs(filename, page_idx, page_text):
+    """切分一页文本并构造 Doc (不含 chunk_id，由调用方分配)"""
+    if not page_text.strip(): return []
+    docs = []
+    for chunk in split_text_into_chunks(page_text):
+        header = f"文档: {filename} (P{page_idx+1})\n"
+        safe_limit = 380 - len(header)
+        safe_chunk = chunk if len(chunk) <= safe_limit else chunk[:safe_limit] + "..."
+        docs.append({
+            "filename": filename, 
+            "page": page_idx, 
+            "content": f"{header}{safe_chunk}", 
+            "text_hash": chunk_hash(safe_chunk)  # 片段级去重只看正文，不含文档/页码头
+        })
+    return docs
+
 def check_ready():
     if not system_ready: return False, "⚠️ 系统未连接"
     return True, ""
@@ -319,7 +503,10 @@ def initialize_system(
             qps=api_qps
         )
         
-        reranker_filter = RerankerAndFilterV2()
+        reranker_filter = RerankerAndFilterV2(
+            cross_encoder=load_cross_encoder_from_env(),
+            rerank_top_n=int(os.getenv("RERANKER_TOP_N", "40"))
+        )
 
         # 5. 初始化 Milvus Store (传入配置好的 ernie client)
         # milvus_store = MilvusVectorStore(
@@ -394,151 +581,461 @@ def process_uploaded_pdf(files, collection_name, progress=gr.Progress()):
         return
 
     online_parser = OnlinePDFParser(api_url, token)
+    journal = target_store.ingest_journal
     try: existing_files = set(target_store.list_documents())
     except: existing_files = set()
 
     total_files = len(files)
-    
-    for i, file_path in enumerate(files):
-        # 1. 准备阶段
+    # 写入阶段的逐文件状态：已写入的组数 / 预期组数 / 入库行数
+    file_states = {}
+    finished = {"files": 0, "rows": 0}
+    # 去重节省的调用：文件级 (跳过 OCR) + 片段级 (复用向量)
+    saved = {"ocr_calls": 0, "ocr_pages": 0, "cloned_chunks": 0}
+    reused_before = target_store.dedup_stats["chunks_reused"]
+
+    # --- 阶段 1: 云端 OCR (文件 N+1 的 OCR 与文件 N 的向量化/写入重叠) ---
+    def ocr_stage(item, emit):
+        i, file_path = item
         path_str = file_path.name if hasattr(file_path, 'name') else file_path
         filename = os.path.basename(path_str)
         abs_path = os.path.abspath(path_str)
-        
-        base_prog = i / total_files
-        
-        # === 实时日志更新 ===
-        log_buffer += f"\n--------------------------------------------------\n"
-        log_buffer += f"📄 [{i+1}/{total_files}] 正在处理: {filename}\n"
-        yield log_buffer # 推送日志
-
-        if filename in existing_files:
-            log_buffer += f"⏩ 文件已存在，跳过。\n"
-            progress((i + 1) / total_files, desc=f"跳过: {filename}")
-            yield log_buffer
-            continue
-            
+
+        pipeline.log(f"\n--------------------------------------------------\n📄 [{i+1}/{total_files}] 正在处理: {filename}\n")
+        content_hash = file_sha256(abs_path)
+        state = journal.file_state(filename)
+        if state is None and filename in existing_files:
+            # 断点日志启用之前入库的文件，没有页级记录，按已完整入库处理
+            journal.mark_complete(filename, content_hash)
+            pipeline.log(f"⏩ {filename}: 文件已存在 (无入库日志)，跳过。\n")
+            finished["files"] += 1
+            return
+        if state is not None and state["content_hash"] != content_hash:
+            pipeline.log(f"♻️ {filename}: 文件内容已变化，清理旧数据后重新入库。\n")
+            target_store.delete_document(filename)
+            state = None
+        if state is not None and state["status"] == "complete":
+            pipeline.log(f"⏩ {filename}: 已完整入库，跳过。\n")
+            finished["files"] += 1
+            return
+        if state is None:
+            # 文件级去重：内容相同的文件 (例如改名后的副本) 直接复用已入库的行，不调用 OCR
+            dup = journal.find_complete_file(content_hash, exclude=filename)
+            if dup and clone_duplicate_file(dup, filename):
+                finished["files"] += 1
+                return
+
+        journal.start_file(filename, content_hash)
+        done_pages = journal.inserted_pages(filename)
         file_img_dir = os.path.join(col_img_dir, os.path.splitext(filename)[0])
-        if os.path.exists(file_img_dir): shutil.rmtree(file_img_dir)
+        start_page = 0
+        if state is not None:
+            # 未完成的文件 (取消/崩溃/部分失败)：先清理上次已写入但未提交的页，避免重新处理后出现重复行
+            expr = f'filename == "{filename}"' + (f' and page not in {sorted(done_pages)}' if done_pages else '')
+            try: target_store.delete_rows(expr)
+            except Exception as e: pipeline.log(f"⚠️ {filename}: 清理未提交数据失败: {e}\n")
+        if done_pages:
+            # 断点续传：只处理未写入的页
+            total = state["total_pages"] if state else None
+            missing = [p for p in range(total) if p not in done_pages] if total else []
+            if total and not missing:
+                journal.finish_file(filename)
+                pipeline.log(f"⏩ {filename}: 所有页均已写入，跳过。\n")
+                finished["files"] += 1
+                return
+            start_page = missing[0] if missing else 0
+            pipeline.log(f"🔁 {filename}: 断点续传，已写入 {len(done_pages)} 页，从第 {start_page + 1} 页继续。\n")
+        else:
+            if os.path.exists(file_img_dir): shutil.rmtree(file_img_dir)
         os.makedirs(file_img_dir, exist_ok=True)
-        
-        # 2. 云端 OCR 请求阶段
-        progress(base_prog + 0.05, desc=f"☁️ OCR请求中: {filename}")
-        log_buffer += f"☁️ 正在请求在线 OCR 服务 (大文件可能需耗时)...\n"
-        yield log_buffer
-        
-        output = []
+
+        pipeline.log(f"☁️ {filename}: 正在请求在线 OCR 服务 (大文件可能需耗时)...\n")
         try:
-            output, err_msg = online_parser.predict(abs_path)
-            if output is None:
-                log_buffer += f"❌ OCR 失败: {err_msg}\n"
-                yield log_buffer
-                continue
-            log_buffer += f"✅ OCR 解析成功，开始处理内容...\n"
-            yield log_buffer
+            output, err_msg = online_parser.predict(abs_path, asset_dir=file_img_dir, start_page=start_page)
         except Exception as e:
-            log_buffer += f"❌ 异常: {str(e)}\n"
-            yield log_buffer
-            continue
+            output, err_msg = None, str(e)
+        if output is None:
+            pipeline.log(f"❌ {filename}: OCR 失败: {err_msg}\n")
+            journal.finish_file(filename)
+            finished["files"] += 1
+            return
+        journal.set_total_pages(filename, len(output))
+        pipeline.log(f"✅ {filename}: OCR 解析成功，开始处理内容...\n")
+        emit((filename, file_img_dir, output, done_pages))
 
-        # 3. 入库阶段
-        file_chunk_count = 0 
-        if output:
-            total_pages = len(output)
-            for page_idx, res in enumerate(output):
-                # 更新进度条
-                step_prog = (page_idx / total_pages) * 0.8
-                current_total = base_prog + 0.2 + (step_prog / total_files)
-                progress(current_total, desc=f"📥 入库中: {filename} (P{page_idx+1})")
-                
-                # 只有当页码变化时才推送日志，避免太频繁刷屏
-                if page_idx % 5 == 0: 
-                    log_buffer += f"   ↳ 正在处理第 {page_idx+1}/{total_pages} 页...\n"
-                    yield log_buffer
+    def clone_duplicate_file(src, filename):
+        try:
+            n_rows = target_store.clone_document(src, filename)
+        except Exception as e:
+            pipeline.log(f"⚠️ {filename}: 复用 {src} 失败，按新文件处理: {e}\n")
+            return False
+        if not n_rows: return False
+        journal.copy_file(src, filename)
+        src_img_dir = os.path.join(col_img_dir, os.path.splitext(src)[0])
+        if os.path.isdir(src_img_dir):
+            shutil.copytree(src_img_dir, os.path.join(col_img_dir, os.path.splitext(filename)[0]), dirs_exist_ok=True)
+        pages = journal.file_state(filename)["total_pages"] or 0
+        saved["ocr_calls"] += 1
+        saved["ocr_pages"] += pages
+        saved["cloned_chunks"] += n_rows
+        finished["rows"] += n_rows
+        pipeline.log(f"🔗 {filename}: 与已入库文件 {src} 内容相同，直接复用其解析结果与向量 ({n_rows} 个片段)。\n")
+        return True
 
-                md_data = res.markdown
-                page_text = md_data.get('markdown_texts', '') 
-                page_images = md_data.get('markdown_images', {})
-             
-                # 图片保存逻辑...
-                for img_path_key, img_val in page_images.items():
-                    try:
-                        base_name = os.path.basename(img_path_key)
-                        sname = f"p{page_idx}_{int(time.time())}_{base_name}"
-                        if not sname.endswith(('.jpg', '.png')): sname += ".jpg"
-                        spath = os.path.join(file_img_dir, sname)
-
-                        if isinstance(img_val, str):
-                            with open(spath, "wb") as f: f.write(base64.b64decode(img_val))
-                        elif hasattr(img_val, 'save'):
-                            img_val.save(spath)
-                        
-                        page_text = page_text.replace(img_path_key, f"[图表: {sname}]")
-                    except Exception as e: pass
-                
-                if not page_text.strip(): continue
+    # --- 阶段 2: 保存图片 + 切分，按组输出片段 (每组只含完整的页)，最后输出文件结束标记 ---
+    def chunk_stage(item, emit):
+        filename = item[0]
+        sent = []
+        def emit_group(group):
+            emit(("docs", filename, group))
+            sent.append(len(group))
+        try:
+            chunk_file(item, emit_group)
+        except Exception as e:
+            # 向下游转发失败标记，由写入阶段结束该文件 (部分入库)；重新抛出以计入本阶段错误数
+            emit(("failed", filename, "chunk", str(e)))
+            emit(("file_done", filename, len(sent)))
+            raise
+        emit(("file_done", filename, len(sent)))
 
-                page_chunks = split_text_into_chunks(page_text)
-                
-                # 构造 Doc
-                docs = []
-                for cid, chunk in enumerate(page_chunks):
-                    header = f"文档: {filename} (P{page_idx+1})\n"
-                    safe_limit = 380 - len(header)
-                    safe_chunk = chunk if len(chunk) <= safe_limit else chunk[:safe_limit] + "..."
-                    docs.append({
-                        "filename": filename, 
-                        "page": page_idx, 
-                        "content": f"{header}{safe_chunk}", 
-                        "chunk_id": file_chunk_count + cid
-                    })
-                
-                if docs:
-                    target_store.insert_documents(docs)
-                    file_chunk_count += len(docs)
+    def chunk_file(item, emit_group):
+        """切分一个文件，按组调用 emit_group 输出片段"""
+        filename, file_img_dir, output, done_pages = item
+        total_pages = len(output)
+        # 续传时新片段的 chunk_id 接在已写入页之后，避免与库中已有片段冲突
+        recorded = journal.page_chunks(filename)
+        file_chunk_count = max([first + n for p, (_, first, n) in recorded.items() if p in done_pages], default=0)
+        group = []
+        page_counts = {}
+        for page_idx, res in enumerate(output):
+            if res is None or page_idx in done_pages: continue
+            # 只有当页码变化时才推送日志，避免太频繁刷屏
+            if page_idx % 5 == 0: 
+                pipeline.log(f"   ↳ {filename}: 正在处理第 {page_idx+1}/{total_pages} 页...\n")
+
+            md_data = res.markdown
+            page_text = save_page_images(page_idx, md_data.get('markdown_texts', ''), md_data.get('markdown_images', {}), file_img_dir)
+            page_docs = build_page_docs(filename, page_idx, page_text)
+            page_counts[page_idx] = (file_chunk_count, len(page_docs))
+            if not page_docs: continue
+
+            for cid, doc in enumerate(page_docs):
+                doc["chunk_id"] = file_chunk_count + cid
+            group.extend(page_docs)
+            file_chunk_count += len(page_docs)
+
+            if len(group) >= EMBED_GROUP_SIZE:
+                journal.record_chunks(filename, page_counts)
+                emit_group(group)
+                group, page_counts = [], {}
+        journal.record_chunks(filename, page_counts)
+        if group: emit_group(group)
 
-        if file_chunk_count > 0:
-            log_buffer += f"✅ {filename}: 成功入库 {file_chunk_count} 个片段。\n"
+    # --- 阶段 3: 批量向量化 ---
+    def embed_stage(item, emit):
+        if item[0] == "docs":
+            _, filename, docs = item
+            try:
+                valid_docs, vectors = target_store.embed_documents(docs)
+            except Exception as e:
+                # 该组作为失败的一组送达写入阶段，保证文件仍能结束；重新抛出以计入本阶段错误数
+                emit(("failed", filename, "embed", str(e)))
+                raise
+            journal.mark_pages(filename, {d["page"] for d in valid_docs}, STAGE_EMBEDDED)
+            emit(("rows", filename, docs, valid_docs, vectors))
         else:
-            log_buffer += f"⚠️ {filename}: 未提取到有效内容。\n"
-        
-        yield log_buffer # 更新单个文件完成后的状态
+            emit(item)
+
+    # --- 阶段 4: 写入缓冲区 (跨组/跨文件攒批写入 Milvus)，每次缓冲区写出后提交页进度，文件的所有组到齐后 flush 一次 ---
+    def commit_written_pages():
+        # 一页的全部片段都带 pk (已写入 Milvus) 才标记为已入库；续传时未提交的页会被清理后重做
+        for fname, st in file_states.items():
+            if not st["docs"]: continue
+            expected = Counter(d["page"] for d in st["docs"])
+            written = Counter(d["page"] for d in st["docs"] if d.get("pk") is not None)
+            pages = {p for p, n in expected.items() if written.get(p) == n}
+            if not pages: continue
+            journal.mark_pages(fname, pages, STAGE_INSERTED)
+            n_rows = sum(written[p] for p in pages)
+            st["rows"] += n_rows
+            finished["rows"] += n_rows
+            st["docs"] = [d for d in st["docs"] if d["page"] not in pages]
+
+    def insert_stage(item, emit):
+        filename = item[1]
+        state = file_states.setdefault(filename, {"groups": 0, "expected": None, "rows": 0, "docs": [], "errors": []})
+        if item[0] == "rows":
+            _, _, docs, valid_docs, vectors = item
+            state["docs"].extend(docs)
+            state["groups"] += 1
+            target_store.buffer_embedded_documents(valid_docs, vectors)
+            commit_written_pages()
+        elif item[0] == "failed":
+            _, _, stage, err = item
+            state["errors"].append(f"{stage}: {err}")
+            # 向量化失败的标记代替了该组的 rows
+            if stage == "embed": state["groups"] += 1
+        else:
+            state["expected"] = item[2]
+
+        if state["expected"] is not None and state["groups"] >= state["expected"]:
+            target_store.flush()
+            commit_written_pages()
+            state["docs"] = []
+            complete = journal.finish_file(filename)
+            status = journal.status(filename)
+            if state["errors"]:
+                pipeline.log(f"❌ {filename}: 处理失败 ({'; '.join(state['errors'])})，已入库 {status['inserted_pages']}/{status['total_pages']} 页，重新上传同一文件将从断点继续。\n")
+            elif not complete:
+                pipeline.log(f"⚠️ {filename}: 部分页面未入库 ({status['inserted_pages']}/{status['total_pages']} 页)，重新上传同一文件将从断点继续。\n")
+            elif state["rows"] > 0:
+                pipeline.log(f"✅ {filename}: 成功入库 {state['rows']} 个片段，共 {status['total_pages']} 页已完整入库。\n")
+            else:
+                pipeline.log(f"⚠️ {filename}: 未提取到有效内容。\n")
+            finished["files"] += 1
+
+    pipeline = IngestPipeline([
+        PipelineStage("ocr", ocr_stage, workers=OCR_WORKERS, queue_size=PIPELINE_QUEUE_SIZE),
+        PipelineStage("chunk", chunk_stage, workers=1, queue_size=PIPELINE_QUEUE_SIZE),
+        PipelineStage("embed", embed_stage, workers=EMBED_WORKERS, queue_size=PIPELINE_QUEUE_SIZE),
+        PipelineStage("insert", insert_stage, workers=1, queue_size=PIPELINE_QUEUE_SIZE),
+    ])
+    # 整个批次处于写缓冲范围内：插入按 write_buffer_rows / write_buffer_seconds 攒批，退出 (含取消) 时 flush 剩余行
+    with target_store.buffered_writes():
+        pipeline.start(enumerate(files))
+
+        # 进度生成器：由各阶段计数器驱动
+        try:
+            while not pipeline.done or not pipeline.messages.empty():
+                pipeline.wait(timeout=0.5)
+                counters = pipeline.counters
+                progress(
+                    min(1.0, finished["files"] / total_files),
+                    desc=f"OCR {counters['ocr']['out']}/{total_files} | 向量化 {counters['embed']['out']} 组 | 已入库 {finished['rows']} 条"
+                )
+                new_logs = pipeline.drain_messages()
+                if new_logs:
+                    log_buffer += new_logs
+                    yield log_buffer
+        finally:
+            if not pipeline.done: pipeline.cancel()
+
+    reused = target_store.dedup_stats["chunks_reused"] - reused_before
+    if saved["ocr_calls"] or reused:
+        batch_size = max(1, getattr(ernie, "embed_batch_size", 16))
+        embed_saved = saved["cloned_chunks"] + reused
+        log_buffer += (f"\n♻️ 去重节省: OCR 请求 {saved['ocr_calls']} 次 ({saved['ocr_pages']} 页), "
+                       f"Embedding 片段 {embed_saved} 条 (约 {-(-embed_saved // batch_size)} 次请求)")
             
     log_buffer += "\n✨ 所有任务已完成！"
     yield log_buffer
 
-def ask_question_logic(question, collection_name, target_filename=None):
+_IMAGE_NAME = re.compile(r"^p(\d+)_\d+_(.+)$")
+
+def reuse_image_names(output, new_dir, old_dir):
+    """
+    重新解析得到的图片若在旧目录中有同页同名的文件，则沿用旧文件名 (去掉新的时间戳)，
+    使未变化片段中的 [图表: ...] 引用保持不变，从而在更新时被识别为未变化
+    """
+    if not os.path.isdir(old_dir): return
+    old_names = {}
+    for name in os.listdir(old_dir):
+        m = _IMAGE_NAME.match(name)
+        if m: old_names[(m.group(1), m.group(2))] = name
+    for res in output:
+        if res is None: continue
+        images = res.markdown.get('markdown_images', {})
+        for key, path in images.items():
+            if not (isinstance(path, str) and os.path.isfile(path)): continue
+            m = _IMAGE_NAME.match(os.path.basename(path))
+            old_name = old_names.get((m.group(1), m.group(2))) if m else None
+            if old_name:
+                new_path = os.path.join(new_dir, old_name)
+                os.replace(path, new_path)
+                images[key] = new_path
+
+def update_uploaded_documents(files, collection_name, progress=gr.Progress()):
+    """
+    更新已入库的文档：重新解析后按片段内容哈希与库中旧片段对比，只删除/写入变化的行，
+    未变化片段保留原向量与 chunk_id
+    """
+    if collection_name: collection_name = str(collection_name).strip()
+    log_buffer = "🚀 更新任务启动...\n"
+    yield log_buffer
+
     ready, msg = check_ready()
-    if not ready: return msg, "N/A"
-    if not question.strip(): return "请输入问题", "0.0%"
-    
-    # 双向翻译逻辑
+    if not ready:
+        yield log_buffer + f"\n{msg}"
+        return
+    if not files:
+        yield log_buffer + "\n⚠️ 未检测到文件，请上传新版本的 PDF。"
+        return
+    if collection_name not in known_collections:
+        yield log_buffer + "\n❌ 知识库不存在，请先上传文档。"
+        return
+
+    token = os.environ.get("OCR_ACCESS_TOKEN", os.environ.get("AISTUDIO_ACCESS_TOKEN"))
+    api_url = os.environ.get("OCR_API_URL")
+    if not api_url or not token:
+        yield log_buffer + "\n❌ 错误: OCR 配置缺失，请检查系统配置。"
+        return
+
+    target_store = known_collections[collection_name]
+    journal = target_store.ingest_journal
+    online_parser = OnlinePDFParser(api_url, token)
+    col_img_dir = os.path.join(ASSET_DIR, collection_name)
+    try: existing_files = set(target_store.list_documents())
+    except: existing_files = set()
+
+    total_files = len(files)
+    for i, file_path in enumerate(files):
+        path_str = file_path.name if hasattr(file_path, 'name') else file_path
+        filename = os.path.basename(path_str)
+        abs_path = os.path.abspath(path_str)
+        progress(i / total_files, desc=f"更新 {i+1}/{total_files}: {filename}")
+        log_buffer += f"\n--------------------------------------------------\n📄 [{i+1}/{total_files}] 正在更新: {filename}\n"
+        yield log_buffer
+
+        if filename not in existing_files:
+            log_buffer += f"⚠️ {filename}: 库中不存在该文档，请使用「上传并解析」。\n"
+            continue
+        content_hash = file_sha256(abs_path)
+        state = journal.file_state(filename)
+        if state and state["content_hash"] == content_hash and state["status"] == "complete":
+            log_buffer += f"⏩ {filename}: 内容未变化，无需更新。\n"
+            continue
+
+        # 新图片先写入临时目录，更新成功后再替换旧目录
+        file_img_dir = os.path.join(col_img_dir, os.path.splitext(filename)[0])
+        staging_dir = f"{file_img_dir}.updating"
+        if os.path.exists(staging_dir): shutil.rmtree(staging_dir)
+        os.makedirs(staging_dir, exist_ok=True)
+
+        log_buffer += f"☁️ {filename}: 正在重新解析...\n"
+        yield log_buffer
+        try:
+            output, err_msg = online_parser.predict(abs_path, asset_dir=staging_dir)
+        except Exception as e:
+            output, err_msg = None, str(e)
+        if output is None:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            log_buffer += f"❌ {filename}: OCR 失败: {err_msg}\n"
+            continue
+
+        reuse_image_names(output, staging_dir, file_img_dir)
+        new_docs = []
+        for page_idx, res in enumerate(output):
+            md_data = res.markdown
+            page_text = save_page_images(page_idx, md_data.get('markdown_texts', ''), md_data.get('markdown_images', {}), staging_dir)
+            new_docs.extend(build_page_docs(filename, page_idx, page_text))
+
+        log_buffer += f"🔍 {filename}: 解析出 {len(new_docs)} 个片段，正在与库中版本对比...\n"
+        yield log_buffer
+        try:
+            stats = target_store.apply_document_update(filename, new_docs)
+        except Exception as e:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            log_buffer += f"❌ {filename}: 更新失败: {e}\n"
+            continue
+
+        if os.path.exists(file_img_dir): shutil.rmtree(file_img_dir)
+        os.replace(staging_dir, file_img_dir)
+
+        # 断点日志按新版本重建：写入失败的页不提交，重新上传时可续传
+        # 每页记录 chunk_id 的覆盖区间，续传时新 chunk_id 从区间之后分配
+        page_ids = {p: [] for p in range(len(output))}
+        for doc in new_docs: page_ids[doc["page"]].append(doc["chunk_id"])
+        page_counts = {p: (min(ids), max(ids) - min(ids) + 1) if ids else (0, 0) for p, ids in page_ids.items()}
+        journal.start_file(filename, content_hash)
+        journal.set_total_pages(filename, len(output))
+        journal.record_chunks(filename, page_counts)
+        journal.mark_pages(filename, [p for p in page_counts if p not in stats["failed_pages"]], STAGE_INSERTED)
+        journal.finish_file(filename)
+
+        log_buffer += (f"✅ {filename}: 保留 {stats['kept']} / 页码迁移 {stats['moved']} / 新增 {stats['added']} / 删除 {stats['removed']} 个片段，"
+                       f"Embedding 请求 {stats['embedded']} 条\n")
+        if stats["failed_pages"]:
+            log_buffer += f"⚠️ {filename}: 第 {', '.join(str(p + 1) for p in stats['failed_pages'])} 页写入失败\n"
+        yield log_buffer
+
+    log_buffer += "\n✨ 更新任务已完成！"
+    yield log_buffer
+
+def _translate_query(question):
+    has_chinese = any('\u4e00' <= char <= '\u9fff' for char in question)
+    prompt = f"Translate the following Chinese query into English directly without explanation:\n{question}" if has_chinese else f"将以下英文问题直接翻译成中文，不要解释：\n{question}"
+    if not ernie: return None
+    result = (ernie.chat([{"role": "user", "content": prompt}]) or "").strip()
+    # chat() 失败时返回的是提示文本而非译文：返回 None，既不缓存也不拼进检索词
+    if not result or result == "模型返回内容为空" or result.startswith("错误:"):
+        print(f"⚠️ [Query] 翻译失败，使用原问题检索: {result or '空结果'}")
+        return None
+    return result
+
+def get_translation(question):
+    """按规范化问题文本缓存翻译结果，并发的相同问题只请求一次"""
+    key = " ".join(question.split())
+    return translation_cache.get_or_compute(key, lambda: _translate_query(question))
+
+def start_query_prep(question, collection_name, translate=True):
+    """
+    提交原问题向量化与双向翻译 (带缓存) 两个并行任务，返回 (translate_future, embed_future)
+    translate=False 时暂不提交翻译 (translate_future 为 None)，由 retrieve_context 在需要时再提交
+    """
+    target_store = known_collections.get(collection_name, milvus_store)
+    return (
+        query_executor.submit(get_translation, question) if translate else None,
+        query_executor.submit(target_store.get_query_embedding, question),
+    )
+
+def start_cached_query_prep(question, collection_name):
+    """
+    问答入口使用：启用答案缓存时先只提交向量化，查缓存未命中后才提交翻译，
+    避免命中缓存时白白请求一次翻译 (已在执行的 LLM 请求无法取消)
+    """
+    return start_query_prep(question, collection_name, translate=answer_cache is None)
+
+def retrieve_context(question, collection_name, target_filename=None, prep=None):
+    """
+    检索 + 重排，返回 (最终片段列表, 置信度, 降级项列表)。prep 为 start_query_prep 已提交的任务 (可选)
+    降级项为本次检索中超时/失败的检索路 (及超时的翻译)，非空时结果不完整，不应写入答案缓存
+    """
+    target_store = known_collections.get(collection_name, milvus_store)
+
+    # 双向翻译逻辑 (带缓存)，与原问题的向量化并行执行
     expanded_query = question
+    degraded = []
+    translate_future, embed_future = prep or start_query_prep(question, collection_name)
+    if translate_future is None:
+        translate_future = query_executor.submit(get_translation, question)
     try:
-        has_chinese = any('\u4e00' <= char <= '\u9fff' for char in question)
-        prompt = f"Translate the following Chinese query into English directly without explanation:\n{question}" if has_chinese else f"将以下英文问题直接翻译成中文，不要解释：\n{question}"
-        
-        if ernie:
-            translated_part = ernie.chat([{"role": "user", "content": prompt}])
-            if translated_part:
-                expanded_query = f"{question} {translated_part}"
-                print(f"✅ [Query] 双语增强后: {expanded_query}")
+        translated_part = translate_future.result(timeout=TRANSLATE_TIMEOUT)
+        if translated_part:
+            expanded_query = f"{question} {translated_part}"
+            print(f"✅ [Query] 双语增强后: {expanded_query}")
+    except FutureTimeoutError:
+        print(f"⚠️ [Query] 翻译超时 ({TRANSLATE_TIMEOUT}s)，使用原问题检索")
+        degraded.append("translate")
     except Exception as e: pass
 
-    target_store = known_collections.get(collection_name, milvus_store)
-    search_kwargs = {"top_k": 60}
+    search_kwargs = {"top_k": 60, "dense_query": question, "adaptive": ADAPTIVE_RETRIEVAL}
     if target_filename and target_filename != "全部文档 (Global QA)":
         search_kwargs["expr"] = f"filename == '{target_filename}'"
-        
-    retrieved = target_store.search(expanded_query, **search_kwargs)
-    if not retrieved: return "未找到相关内容。", "0.0%"
+
+    try: embed_future.result()
+    except Exception as e: pass
+    candidates = target_store.search_candidates(expanded_query, **search_kwargs)
+    degraded += getattr(candidates, "degraded_legs", [])
+    if not candidates: return [], "0.0%", degraded
+    retrieved = target_store.hydrate(candidates, limit=RERANK_CANDIDATES)
+    if not retrieved: return [], "0.0%", degraded
     
     processed, _ = reranker_filter.process(expanded_query, retrieved)
     final = processed[:22]
     top_score = final[0].get('composite_score', 0) if final else 0
     metric = f"{min(100, top_score):.1f}%"
-    
-    answer = ernie.answer_question(question, final)
+    return final, metric, degraded
+
+def format_sources(final):
     seen = set()
     sources = "\n\n📚 **参考来源:**\n"
     for c in final:
@@ -548,10 +1045,93 @@ def ask_question_logic(question, collection_name, target_filename=None):
         if key not in seen:
             sources += f"- {key} [相关性:{c.get('composite_score',0):.0f}%]\n"
             seen.add(key)
-            
-    return answer + sources, metric
+    return sources
+
+def _answer_cache_key(collection_name, target_filename, embed_future):
+    """
+    答案缓存的键 (知识库, 文件过滤, 问题向量, 数据版本)；缓存关闭或向量化失败时返回 None
+    问题向量取自 start_query_prep 的向量化任务
+    """
+    if answer_cache is None: return None
+    store = known_collections.get(collection_name, milvus_store)
+    file_filter = target_filename if target_filename and target_filename != "全部文档 (Global QA)" else None
+    try:
+        query_vector = embed_future.result()
+    except Exception:
+        return None
+    if not query_vector: return None
+    # 版本号在检索前读取：生成期间若有写入，缓存的回答会立即过期
+    return (collection_name, file_filter, query_vector, store.data_version)
+
+def lookup_answer_cache(cache_key):
+    if cache_key is None: return None
+    hit = answer_cache.lookup(*cache_key)
+    if hit:
+        stats = answer_cache.stats()
+        print(f"⚡ [Cache] 命中语义答案缓存 (相似度 {hit[2]:.3f}, 累计命中率 {stats['hit_rate']*100:.0f}%, {stats['size']} 条)")
+    return hit
+
+def ask_question_logic(question, collection_name, target_filename=None):
+    ready, msg = check_ready()
+    if not ready: return msg, "N/A"
+    if not question.strip(): return "请输入问题", "0.0%"
+
+    prep = start_cached_query_prep(question, collection_name)
+    cache_key = _answer_cache_key(collection_name, target_filename, prep[1])
+    cached = lookup_answer_cache(cache_key)
+    if cached: return cached[0], cached[1]
+
+    final, metric, degraded = retrieve_context(question, collection_name, target_filename, prep=prep)
+    if not final: return "未找到相关内容。", "0.0%"
+
+    answer = ernie.answer_question(question, final)
+    full_answer = answer + format_sources(final)
+    # 检索有降级 (某路超时/失败) 时结果不完整，不缓存，避免在版本失效前一直返回降级的回答
+    if cache_key and answer != "生成回答失败" and not degraded:
+        answer_cache.put(*cache_key, full_answer, metric)
+    return full_answer, metric
+
+def ask_question_stream(question, collection_name, target_filename=None):
+    """ask_question_logic 的流式版本：逐步 yield (已生成的回答, 置信度)"""
+    ready, msg = check_ready()
+    if not ready:
+        yield msg, "N/A"
+        return
+    if not question.strip():
+        yield "请输入问题", "0.0%"
+        return
+
+    prep = start_cached_query_prep(question, collection_name)
+    cache_key = _answer_cache_key(collection_name, target_filename, prep[1])
+    cached = lookup_answer_cache(cache_key)
+    if cached:
+        yield cached[0], cached[1]
+        return
+
+    final, metric, degraded = retrieve_context(question, collection_name, target_filename, prep=prep)
+    if not final:
+        yield "未找到相关内容。", "0.0%"
+        return
+
+    answer = ""
+    failed = False
+    try:
+        for delta in ernie.answer_question_stream(question, final):
+            answer += delta
+            yield answer, metric
+    except Exception as e:
+        answer += f"\n\n❌ 生成回答失败: {e}"
+        failed = True
+    full_answer = answer + format_sources(final)
+    if cache_key and answer and not failed and not degraded:
+        answer_cache.put(*cache_key, full_answer, metric)
+    yield full_answer, metric
+
 def chat_respond(message, history, collection_name, target_filename, img_context_data):
-    if not message: return history, history, "", "N/A", img_context_data
+    """生成器：边生成边把部分回答推送给 Chatbot"""
+    if not message:
+        yield history, "", "N/A", img_context_data
+        return
     
     user_display_text = message
     bot_response_text = ""
@@ -617,11 +1197,14 @@ def chat_respond(message, history, collection_name, target_filename, img_context
     # ============================================================
     # 降级/常规 RAG 通道 (仅当多模态未成功时执行)
     # ============================================================
+    history.append({"role": "user", "content": user_display_text})
+    history.append({"role": "assistant", "content": bot_response_text})
+
     if not vision_success:
         print("🔄 执行文本 RAG 通道")
         
         if not collection_name: 
-            bot_response_text = "⚠️ 请先选择知识库"
+            history[-1]["content"] = "⚠️ 请先选择知识库"
         else:
             # 构造查询
             full_query = message
@@ -632,17 +1215,17 @@ def chat_respond(message, history, collection_name, target_filename, img_context
                 full_query = final_prompt
                 prefix_hint = "ℹ️ **系统提示**：当前模型不支持视觉输入，已自动根据图表周围的文本为您分析。\n\n"
 
-            # 执行检索问答
-            answer, metric = ask_question_logic(full_query, collection_name, target_filename)
-            
-            # 更新暂存变量
-            bot_response_text = prefix_hint + answer
-            metric_info = metric
+            history[-1]["content"] = prefix_hint + "⏳ 正在检索相关资料..."
+            yield history, "", metric_info, None
 
-    history.append({"role": "user", "content": user_display_text})
-    history.append({"role": "assistant", "content": bot_response_text})
-    
-    return history, "", metric_info, None
+            # 执行检索问答 (流式)
+            for answer, metric in ask_question_stream(full_query, collection_name, target_filename):
+                history[-1]["content"] = prefix_hint + answer
+                metric_info = metric
+                yield history, "", metric_info, None
+            return
+
+    yield history, "", metric_info, None
 # def chat_respond(message, history, collection_name, target_filename, img_context):
 #     if not message: return history, history, "", "N/A", img_context
 #     if not collection_name: 
@@ -672,6 +1255,14 @@ def analyze_doc_and_images(collection_name, filename):
         summary = ernie.generate_summary(text[:3000])
     else:
         summary = "无法获取内容 (可能是纯图片文档或解析失败)"
+
+    status = store.ingest_journal.status(filename)
+    if status["complete"]:
+        status_line = "✅ 已完整入库" + (f" ({status['total_pages']} 页)" if status["total_pages"] else "")
+    elif status["status"] == "unknown":
+        status_line = "❔ 无入库记录"
+    else:
+        status_line = f"⚠️ 未完整入库 ({status['inserted_pages']}/{status['total_pages'] or '?'} 页)，重新上传可断点续传"
     
     images = []
     file_img_path = os.path.join(ASSET_DIR, collection_name, os.path.splitext(filename)[0])
@@ -684,7 +1275,7 @@ def analyze_doc_and_images(collection_name, filename):
                 full_path = os.path.join(file_img_path, img_file)
                 images.append((full_path, img_file))
                 
-    return f"📄 **{filename}**\n\n{summary}", images
+    return f"📄 **{filename}**  {status_line}\n\n{summary}", images
 
 def update_file_list(collection_name):
     ready, msg = check_ready()
@@ -716,6 +1307,39 @@ def run_recall_test(collection_name):
     store = known_collections.get(collection_name, milvus_store)
     return store.test_self_recall(sample_size=20)
 
+def rebuild_collection_index(collection_name, index_type):
+    """重建所选知识库的向量索引：选择具体类型时使用该预设，否则按 INDEX_CONFIG / 构造参数中该集合的配置"""
+    ready, msg = check_ready()
+    if not ready: return msg
+    if not collection_name: return "❌ 请先选择一个知识库"
+
+    store = known_collections.get(collection_name, milvus_store)
+    config = index_type if index_type in INDEX_PRESETS else store.configured_index_config()
+    try:
+        return store.rebuild_index(config)
+    except Exception as e:
+        return f"❌ 索引重建失败: {e}"
+
+def run_index_report(collection_name):
+    ready, msg = check_ready()
+    if not ready: return msg
+    if not collection_name: return "❌ 请先选择一个知识库"
+
+    store = known_collections.get(collection_name, milvus_store)
+    report = store.recall_latency_report(sample_size=20)
+    if ernie is not None:
+        for name, m in ernie.get_rate_metrics().items():
+            report += (f"\n{name} 限流: 有效速率 {m['effective_qps']:.2f} QPS / 目标 {m['target_qps']:.2f} QPS | "
+                       f"累计限流 {m['throttle_count']} 次")
+        ttft = ernie.get_latency_metrics()["ttft"]
+        if ttft["count"]:
+            report += f"\n流式回答首 token 延迟 ({ttft['count']}次): p50 {ttft['p50']:.2f}s / p95 {ttft['p95']:.2f}s"
+    if answer_cache is not None:
+        stats = answer_cache.stats()
+        report += (f"\n语义答案缓存: 命中 {stats['hits']} / 未命中 {stats['misses']} (命中率 {stats['hit_rate']*100:.0f}%) | "
+                   f"过期 {stats['stale']} / 淘汰 {stats['evictions']} | {stats['size']}/{answer_cache.maxsize} 条")
+    return report
+
 def create_collection_ui(new_name):
     global ernie
     ready, msg = check_ready()
@@ -775,6 +1399,12 @@ def delete_collection_ui(name):
             utility.drop_collection(real_milvus_name, using=alias)
         if name in known_collections: 
             del known_collections[name]
+        bump_collection_version(real_milvus_name)
+        if answer_cache is not None: answer_cache.invalidate(name)
+        try: remove_keyword_index(os.environ.get("MILVUS_URI"), real_milvus_name)
+        except: pass
+        try: remove_ingest_journal(os.environ.get("MILVUS_URI"), real_milvus_name)
+        except: pass
         
         img_path = os.path.join(ASSET_DIR, name)
         if os.path.exists(img_path): shutil.rmtree(img_path)
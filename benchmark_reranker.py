@@ -0,0 +1,60 @@
+import time
+import random
+import argparse
+import statistics
+
+from utils.reranker_v2 import RerankerAndFilterV2
+
+# === 配置 ===
+CANDIDATE_SIZES = [100, 1000, 10000]
+REPEATS = 5
+QUERIES = [
+    "What is the role of the Transformer attention mechanism in BERT?",
+    "ERNIE 模型的预训练任务有哪些？",
+    "PaddleOCR 如何识别表格结构",
+]
+
+_ZH_TEXT = "本文提出了一种基于注意力机制的文档解析方法，在多个公开数据集上取得了领先的效果，并分析了模型在长文本上的表现。"
+_EN_WORDS = ("the model uses attention layers to encode documents and tables with BERT ERNIE Transformer "
+             "pretraining objectives masked language modeling OCR layout parsing retrieval").split()
+
+
+def make_candidates(n, seed=0):
+    """构造与线上检索结果结构一致的候选片段 (长度 100~800，中英混合)"""
+    rng = random.Random(seed)
+    chunks = []
+    for i in range(n):
+        en = " ".join(rng.choice(_EN_WORDS) for _ in range(rng.randint(10, 60)))
+        zh = _ZH_TEXT * rng.randint(1, 4)
+        content = f"文档: paper_{i % 50}.pdf (P{i % 30 + 1})\n{zh} {en}"[:rng.randint(100, 800)]
+        chunks.append({
+            "id": i,
+            "content": content,
+            "semantic_score": rng.uniform(0, 2) if rng.random() > 0.2 else None,
+        })
+    return chunks
+
+
+def run_benchmark(sizes, repeats):
+    reranker = RerankerAndFilterV2()
+    print(f"{'候选数':>8} | {'p50 (ms)':>10} | {'min (ms)':>10} | {'每候选 (µs)':>12}")
+    print("-" * 50)
+    for n in sizes:
+        candidates = make_candidates(n)
+        timings = []
+        for r in range(repeats):
+            query = QUERIES[r % len(QUERIES)]
+            batch = [dict(c) for c in candidates]  # process 会写入分数字段，每次使用新副本
+            start = time.perf_counter()
+            reranker.process(query, batch)
+            timings.append(time.perf_counter() - start)
+        p50 = statistics.median(timings)
+        print(f"{n:>8} | {p50 * 1000:>10.2f} | {min(timings) * 1000:>10.2f} | {p50 / n * 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reranker 单次查询耗时基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=CANDIDATE_SIZES, help="候选数量 (默认 100 1000 10000)")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="每个规模重复次数")
+    args = parser.parse_args()
+    run_benchmark(args.sizes, args.repeats)
@@ -190,7 +190,7 @@ class FinalSaverEvaluator:
             try:
                 content_emb = self.vector_store.embedding_client.get_embedding(item['source_content'])
                 res_phy = self.vector_store.collection.search(
-                    data=[content_emb], anns_field="embedding", param={"metric_type": "L2", "params": {}}, 
+                    data=[content_emb], anns_field="embedding", param=self.vector_store.search_params(limit=TOP_K_RETRIEVAL), 
                     limit=TOP_K_RETRIEVAL, output_fields=["id"]
                 )
                 ids_phy = [h.id for h in res_phy[0]]
@@ -234,6 +234,9 @@ class FinalSaverEvaluator:
         print(f"{'3. Page Recall':<25} | {get_pct('page_recall'):6.2f}%    | 中观定位")
         print(f"{'4. Chunk Recall':<25} | {get_pct('chunk_recall'):6.2f}%    | 微观定位")
         print("="*80)
+        if self.llm.embed_cache:
+            cache_stats = self.llm.embed_cache.stats()
+            print(f"🗄️ Embedding 缓存: 命中 {cache_stats['hits']} / 未命中 {cache_stats['misses']} (命中率 {cache_stats['hit_rate']*100:.1f}%)")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="PDF QA 系统性能评估工具")
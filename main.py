@@ -479,6 +479,8 @@ with gr.Blocks(title="多文档高精度智能分析与问答系统", theme=them
                     with gr.Row():
                         # 上传按钮
                         upload_btn = gr.Button("🚀 上传并解析", variant="primary", scale=3)
+                        # 更新按钮：只重新向量化变化的片段
+                        update_btn = gr.Button("♻️ 更新文档", variant="secondary", scale=2)
                         # 终止按钮
                         stop_btn = gr.Button("🛑 终止任务", variant="stop", scale=1)
                     gr.HTML('<div style="height:20px"></div>')
@@ -518,8 +520,12 @@ with gr.Blocks(title="多文档高精度智能分析与问答系统", theme=them
                         gr.HTML('<div class="card-header"><span>🧪</span> 效果诊断</div>')
                         with gr.Row():
                             test_recall_btn = gr.Button("🔍 运行召回率测试", size="sm")
+                            index_report_btn = gr.Button("📈 召回/延迟报告", size="sm")
+                        with gr.Row(variant="compact", elem_classes="row-center"):
+                            index_type_select = gr.Dropdown(show_label=False, choices=["按配置"] + list(backend.INDEX_PRESETS), value="按配置", info="索引类型", scale=3, container=False)
+                            rebuild_index_btn = gr.Button("🔧 重建索引", size="sm", scale=1)
                         gr.HTML('<div style="height:10px"></div>')
-                        test_result_box = gr.Textbox(show_label=False, lines=2, placeholder="测试结果...", container=False)
+                        test_result_box = gr.Textbox(show_label=False, lines=2, max_lines=12, placeholder="测试结果...", container=False)
 
         # ... 系统配置 ...
         with gr.Tab("⚙️ 系统配置"):
@@ -659,17 +665,24 @@ with gr.Blocks(title="多文档高精度智能分析与问答系统", theme=them
         outputs=[upload_log] # 输出目标是日志框
     )
     
+    update_event = update_btn.click(
+        backend.update_uploaded_documents,
+        inputs=[files_input, upload_col_select],
+        outputs=[upload_log]
+    )
+    
     stop_btn.click(
         fn=None, 
         inputs=None, 
         outputs=None, 
-        cancels=[upload_event]
+        cancels=[upload_event, update_event]
     )
     
     # 3. 链式回调：任务完成（或被终止）后，依然刷新下拉列表
     upload_event.then(backend.refresh_all_dropdowns, outputs=[qa_col_select, upload_col_select, del_col_select]) \
                 .then(backend.update_file_list, inputs=[qa_col_select], outputs=[qa_file_select]) \
                 .then(backend.update_file_list_for_delete, inputs=[upload_col_select], outputs=[del_file_select])
+    update_event.then(backend.update_file_list, inputs=[qa_col_select], outputs=[qa_file_select])
     create_btn.click(backend.create_collection_ui, inputs=[new_col_name], outputs=[upload_col_select, create_msg]).then(backend.refresh_all_dropdowns, outputs=[qa_col_select, upload_col_select, del_col_select])
     del_btn.click(backend.delete_collection_ui, inputs=[del_col_select], outputs=[upload_col_select, del_col_msg]).then(backend.refresh_all_dropdowns, outputs=[qa_col_select, upload_col_select, del_col_select])
     upload_col_select.change(backend.update_file_list_for_delete, inputs=[upload_col_select], outputs=[del_file_select])
@@ -679,6 +692,8 @@ with gr.Blocks(title="多文档高精度智能分析与问答系统", theme=them
     # submit_btn.click(backend.chat_respond, inputs=[msg, chatbot, qa_col_select, qa_file_select, image_context_state], outputs=[chatbot, chatbot, msg, qa_metric, image_context_state])
     clear_btn.click(lambda: ([], "", "N/A", ""), outputs=[chatbot, msg, qa_metric, image_context_state])
     test_recall_btn.click(backend.run_recall_test, inputs=[upload_col_select], outputs=[test_result_box])
+    index_report_btn.click(backend.run_index_report, inputs=[upload_col_select], outputs=[test_result_box])
+    rebuild_index_btn.click(backend.rebuild_collection_index, inputs=[upload_col_select, index_type_select], outputs=[test_result_box])
     
 def find_free_port(start=7860):
     for port in range(start, start+10):
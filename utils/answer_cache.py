@@ -0,0 +1,103 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger("answer_cache")
+
+
+class SemanticAnswerCache:
+    """
+    语义答案缓存：按 (知识库, 文件过滤, 问题向量) 缓存最终回答
+    - 同一 (知识库, 文件过滤) 下与已缓存问题的余弦相似度 >= threshold 即命中 (改写/同义问题也能复用)
+    - 每条记录带写入时的知识库版本号，版本变化 (有插入/删除) 后视为过期
+    - 条目数上限 maxsize，超出时按 LRU 淘汰；可选 TTL
+    """
+    def __init__(self, maxsize: int = 512, threshold: float = 0.95, ttl: float = None):
+        self.maxsize = max(1, int(maxsize))
+        self.threshold = float(threshold)
+        self.ttl = float(ttl) if ttl else None
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # entry_id -> (scope, 单位向量, 回答, 置信度, 版本, 写入时间)
+        self._scopes = {}              # (知识库, 文件过滤) -> {entry_id}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vector):
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm > 0 else None
+
+    def _remove_locked(self, entry_id):
+        scope = self._entries.pop(entry_id)[0]
+        ids = self._scopes.get(scope)
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids: del self._scopes[scope]
+
+    def lookup(self, collection, file_filter, query_vector, version):
+        """命中返回 (回答, 置信度, 相似度)，否则返回 None"""
+        vec = self._unit(query_vector) if query_vector else None
+        if vec is None: return None
+        scope = (collection, file_filter)
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            for entry_id in list(self._scopes.get(scope, ())):
+                entry = self._entries[entry_id]
+                if entry[4] != version or (self.ttl and now - entry[5] > self.ttl):
+                    self._remove_locked(entry_id)
+                    self.stale += 1
+                    continue
+                candidates.append(entry_id)
+            if candidates:
+                sims = np.stack([self._entries[i][1] for i in candidates]) @ vec
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    entry_id = candidates[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    _, _, answer, metric, _, _ = self._entries[entry_id]
+                    return answer, metric, float(sims[best])
+            self.misses += 1
+            return None
+
+    def put(self, collection, file_filter, query_vector, version, answer, metric):
+        vec = self._unit(query_vector) if query_vector else None
+        if vec is None or not answer: return
+        scope = (collection, file_filter)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (scope, vec, answer, metric, version, time.monotonic())
+            self._scopes.setdefault(scope, set()).add(entry_id)
+            while len(self._entries) > self.maxsize:
+                self._remove_locked(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, collection):
+        """删除某个知识库的全部缓存 (例如知识库被删除时)"""
+        with self._lock:
+            for scope in [s for s in self._scopes if s[0] == collection]:
+                for entry_id in list(self._scopes[scope]):
+                    self._remove_locked(entry_id)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": len(self._entries),
+        }
@@ -0,0 +1,285 @@
+import os
+import re
+import json
+import math
+import time
+import heapq
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger("bm25_index")
+
+try:
+    import jieba
+    jieba.setLogLevel(logging.WARNING)
+except ImportError:
+    jieba = None
+
+STOP_WORDS = {
+    "的", "了", "和", "是", "就", "都", "而", "及", "与", "着", "或",
+    "一个", "没有", "我们", "你们", "他们", "它", "解释", "是什么",
+    "含义", "文章", "图片", "这个", "篇", "请问", "以及", "什么",
+    "如何", "怎么", "为什么", "分析", "介绍", "描述",
+    "what", "is", "the", "of", "in", "and", "to", "a", "an", "are",
+    "explain", "describe", "tell", "me", "about", "how", "why", "paper", "article"
+}
+
+_CJK_RUN = re.compile(r'[\u4e00-\u9fff]+')
+_WORD = re.compile(r'[a-z0-9][a-z0-9_\-\.]*[a-z0-9]|[a-z0-9]')
+_WORD_SEP = re.compile(r'[_\-\.]+')
+
+# 分词规则的版本：规则变化后旧索引的词项不再可比，加载时发现版本不一致会丢弃并从 Milvus 重建
+TOKENIZER_VERSION = 2
+
+
+def tokenize(text: str) -> list:
+    """
+    中文用 jieba 搜索引擎模式分词 (未安装时退化为双字切分)，英文/数字按单词切分，统一小写并去停用词
+    含 - . _ 的复合词 (如 bert-base、v1.2、pp-ocrv4) 既保留整体，也拆出各部分，查询 "bert" 同样能命中
+    """
+    if not text: return []
+    text = text.lower()
+    tokens = []
+    for word in _WORD.findall(text):
+        tokens.append(word)
+        if _WORD_SEP.search(word):
+            tokens.extend(part for part in _WORD_SEP.split(word) if part)
+    for run in _CJK_RUN.findall(text):
+        if jieba is not None:
+            tokens.extend(w for w in jieba.cut_for_search(run) if len(w) > 1)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return [t for t in tokens if t not in STOP_WORDS and (len(t) > 1 or _CJK_RUN.fullmatch(t))]
+
+
+class _StaleIndex(Exception):
+    """持久化的索引由旧版分词规则生成"""
+
+
+# 追加日志中的操作数超过 max(该值, 2 × 文档数) 时压缩为新快照 (摊销后每次变更的落盘开销为常数)
+COMPACT_MIN_OPS = 20000
+
+
+class BM25Index:
+    """
+    增量维护的 BM25 倒排索引
+    - postings: term -> {doc_id: tf}；doc_terms 记录每个文档的词项，删除时只触及这些倒排表
+    - 查询只遍历命中词项的倒排表，复杂度与命中文档数相关，而非集合大小
+    - 持久化 = JSON 快照 + 追加日志 (path.log，每行一个带序号的增/删操作)：
+      save() 只把上次以来的变更追加到日志；日志过长时在锁外写新快照 (临时文件 + 原子替换) 并清空日志。
+      加载时读快照，再重放序号大于快照序号的日志操作
+    """
+    def __init__(self, path: str = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.log_path = f"{path}.log" if path else None
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_len = {}
+        self.doc_file = {}
+        self.doc_terms = {}
+        self.total_len = 0
+        self._seq = 0          # 最近一次变更的序号
+        self._pending = []     # 尚未写入日志的操作 [(序号, 操作, 参数)]
+        self._log_ops = 0      # 日志中的操作数
+        self._lock = threading.RLock()     # 保护内存索引，检索与增删使用
+        self._io_lock = threading.Lock()   # 串行化落盘，不阻塞检索
+        if path and self.persisted:
+            self.load()
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    @property
+    def persisted(self) -> bool:
+        return bool(self.path) and (os.path.exists(self.path) or os.path.exists(self.log_path))
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._pending)
+
+    def _record(self, op, args=None):
+        self._seq += 1
+        self._pending.append((self._seq, op, args))
+
+    def _reset(self):
+        self.postings, self.doc_len, self.doc_file, self.doc_terms, self.total_len = {}, {}, {}, {}, 0
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+            self._pending = []
+            self._record("clear")
+
+    def _add(self, doc_id, fname, counts):
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        length = sum(counts.values())
+        self.doc_len[doc_id] = length
+        self.doc_file[doc_id] = fname
+        self.doc_terms[doc_id] = list(counts)
+        self.total_len += length
+
+    def add_many(self, ids: list, texts: list, filenames: list):
+        with self._lock:
+            self.remove_ids([i for i in ids if int(i) in self.doc_len])
+            for doc_id, text, fname in zip(ids, texts, filenames):
+                counts = dict(Counter(tokenize(text)))
+                self._add(int(doc_id), fname, counts)
+                self._record("add", (int(doc_id), fname, counts))
+
+    def _remove(self, id_set):
+        for doc_id in id_set:
+            self.total_len -= self.doc_len.pop(doc_id)
+            self.doc_file.pop(doc_id, None)
+            for term in self.doc_terms.pop(doc_id, ()):
+                plist = self.postings.get(term)
+                if plist is None: continue
+                plist.pop(doc_id, None)
+                if not plist: del self.postings[term]
+
+    def remove_ids(self, ids: list):
+        with self._lock:
+            id_set = {int(i) for i in ids if int(i) in self.doc_len}
+            if not id_set: return 0
+            self._remove(id_set)
+            self._record("del", sorted(id_set))
+            return len(id_set)
+
+    def remove_filename(self, filename: str):
+        with self._lock:
+            ids = [doc_id for doc_id, fname in self.doc_file.items() if fname == filename]
+            return self.remove_ids(ids)
+
+    def search(self, query: str, top_k: int = 50, filenames: set = None) -> list:
+        """返回按 BM25 分数降序的 [(doc_id, score)]，filenames 不为空时只在这些文件内检索"""
+        terms = set(tokenize(query))
+        if not terms: return []
+        with self._lock:
+            n_docs = len(self.doc_len)
+            if n_docs == 0: return []
+            avgdl = self.total_len / n_docs if n_docs else 1.0
+            scores = {}
+            for term in terms:
+                plist = self.postings.get(term)
+                if not plist: continue
+                idf = math.log(1 + (n_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+                for doc_id, tf in plist.items():
+                    if filenames and self.doc_file.get(doc_id) not in filenames: continue
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / avgdl)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(top_k, scores.items(), key=lambda x: x[1])
+
+    @staticmethod
+    def _log_line(seq, op, args):
+        if op == "add":
+            doc_id, fname, counts = args
+            return json.dumps({"s": seq, "op": "add", "v": TOKENIZER_VERSION, "id": doc_id, "f": fname, "tf": counts}, ensure_ascii=False)
+        if op == "del":
+            return json.dumps({"s": seq, "op": "del", "ids": args})
+        return json.dumps({"s": seq, "op": op})
+
+    def save(self):
+        """把未落盘的变更追加到日志 (只在取出变更时短暂持锁)；日志过长时压缩为新快照"""
+        if not self.path: return
+        with self._io_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                compact = (self._log_ops + len(pending) > max(COMPACT_MIN_OPS, 2 * len(self.doc_len))
+                           or any(op == "clear" for _, op, _ in pending))
+                if compact:
+                    # 只在锁内复制结构，序列化与写文件都在锁外进行
+                    snapshot = {
+                        "k1": self.k1, "b": self.b, "seq": self._seq, "tokenizer": TOKENIZER_VERSION,
+                        "doc_len": dict(self.doc_len),
+                        "doc_file": dict(self.doc_file),
+                        "postings": {t: list(p.items()) for t, p in self.postings.items()},
+                    }
+            if compact:
+                self._write_snapshot(snapshot)
+            elif pending:
+                self._append_log(pending)
+
+    def _append_log(self, pending):
+        dirname = os.path.dirname(self.log_path)
+        if dirname: os.makedirs(dirname, exist_ok=True)
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write("".join(self._log_line(*item) + "\n" for item in pending))
+        self._log_ops += len(pending)
+
+    def _write_snapshot(self, snapshot):
+        start = time.time()
+        dirname = os.path.dirname(self.path)
+        if dirname: os.makedirs(dirname, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        data = json.dumps(snapshot, ensure_ascii=False)  # 一次性序列化再写入，比 json.dump 逐段写文件快得多
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+        # 快照已包含截至 seq 的全部操作；此时崩溃留下的旧日志会在加载时按序号跳过
+        open(self.log_path, "w").close()
+        self._log_ops = 0
+        logger.info(f"🗜️ BM25 索引快照: {len(snapshot['doc_len'])} 条, 耗时 {time.time() - start:.1f}s")
+
+    def load(self):
+        with self._lock:
+            try:
+                snapshot_seq = 0
+                self._reset()
+                if os.path.exists(self.path):
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                    if data.get("tokenizer") != TOKENIZER_VERSION:
+                        raise _StaleIndex()
+                    snapshot_seq = data.get("seq", 0)
+                    self.doc_len = {int(k): v for k, v in data.get("doc_len", {}).items()}
+                    self.doc_file = {int(k): v for k, v in data.get("doc_file", {}).items()}
+                    self.postings = {t: {int(d): tf for d, tf in p} for t, p in data.get("postings", {}).items()}
+                    for term, plist in self.postings.items():
+                        for doc_id in plist:
+                            self.doc_terms.setdefault(doc_id, []).append(term)
+                    self.total_len = sum(self.doc_len.values())
+                self._seq = snapshot_seq
+                replayed = self._replay_log(snapshot_seq)
+                self._pending = []
+                logger.info(f"📖 加载 BM25 索引: {self.path} ({len(self.doc_len)} 条, 重放日志 {replayed} 条)")
+            except _StaleIndex:
+                # 删除旧文件，persisted 变为 False，由调用方从 Milvus 重建
+                logger.warning(f"⚠️ BM25 索引分词版本已变化，将重建: {self.path}")
+                self._reset()
+                self._pending, self._log_ops = [], 0
+                for path in (self.path, self.log_path):
+                    if os.path.exists(path): os.remove(path)
+            except Exception as e:
+                logger.error(f"❌ BM25 索引加载失败，将重建: {e}")
+                self._reset()
+
+    def _replay_log(self, snapshot_seq):
+        if not os.path.exists(self.log_path): return 0
+        replayed = 0
+        with open(self.log_path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        self._log_ops = len(lines)
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # 写入中途崩溃留下的残行
+                logger.warning("⚠️ BM25 日志存在不完整的行，已跳过")
+                continue
+            if entry["s"] <= snapshot_seq: continue
+            if entry["op"] == "add":
+                if entry.get("v") != TOKENIZER_VERSION: raise _StaleIndex()
+                doc_id = int(entry["id"])
+                if doc_id in self.doc_len: self._remove({doc_id})
+                self._add(doc_id, entry["f"], entry["tf"])
+            elif entry["op"] == "del":
+                self._remove({int(i) for i in entry["ids"] if int(i) in self.doc_len})
+            elif entry["op"] == "clear":
+                self._reset()
+            self._seq = max(self._seq, entry["s"])
+            replayed += 1
+        return replayed
@@ -0,0 +1,111 @@
+import re
+import logging
+
+logger = logging.getLogger("context_packer")
+
+# 入库时每个片段开头的 "文档: xxx (Pn)" 标题行，拼接上下文时已有来源标注，去掉以节省 token
+_DOC_HEADER = re.compile(r'^文档: .*? \(P\d+\)\n')
+# 相邻片段的重叠长度上限 (切分 overlap 为 120 字符，留出余量)
+MAX_OVERLAP = 200
+# 3-gram Jaccard 相似度不低于该值视为近似重复
+NEAR_DUP_THRESHOLD = 0.85
+
+
+def _body(chunk) -> str:
+    return _DOC_HEADER.sub('', chunk.get('content', '') or '', count=1).strip()
+
+
+def _shingles(text: str) -> set:
+    text = " ".join(text.split())
+    return {text[i:i + 3] for i in range(max(1, len(text) - 2))}
+
+
+def _overlap(left: str, right: str) -> int:
+    """left 的后缀与 right 的前缀重合的最大长度 (切分时的 overlap 部分)"""
+    for k in range(min(len(left), len(right), MAX_OVERLAP), 9, -1):
+        if left.endswith(right[:k]): return k
+    return 0
+
+
+class PackedPassage:
+    """打包后的一段上下文：同一文件同一页的连续片段合并而成"""
+    __slots__ = ("filename", "page", "chunk_ids", "text", "score")
+
+    def __init__(self, filename, page, chunk_id, text, score):
+        self.filename = filename
+        self.page = page
+        self.chunk_ids = [chunk_id]
+        self.text = text
+        self.score = score
+
+
+def pack_context(chunks: list, token_budget: int, estimate_tokens, label_tokens: int = 16) -> list:
+    """
+    按 token 预算打包上下文 (chunks 为重排后的片段，按 composite_score 从高到低贪心选取)
+    - 与已选片段近似重复 (正文包含或 3-gram Jaccard >= NEAR_DUP_THRESHOLD) 的跳过
+    - 与已选的同页相邻片段 (chunk_id 相差 1) 的重叠部分不重复计费，最终合并为一段
+    - 放不下的片段跳过，继续尝试分数更低但更短的片段；第一名放不下时截断到预算内
+    label_tokens 为每段来源标注的估算 token 数。返回按最高分排序的 PackedPassage 列表
+    """
+    ranked = sorted(chunks, key=lambda c: c.get('composite_score', 0), reverse=True)
+    selected = []   # (chunk, 正文, shingles)
+    by_position = {}  # (文件名, 页码, chunk_id) -> 正文
+    used = 0
+    dropped_dup = dropped_budget = 0
+
+    for chunk in ranked:
+        text = _body(chunk)
+        if not text: continue
+        shingles = _shingles(text)
+        if any(text in other or other in text or len(shingles & s) / len(shingles | s) >= NEAR_DUP_THRESHOLD
+               for _, other, s in selected):
+            dropped_dup += 1
+            continue
+
+        fname, page, chunk_id = chunk.get('filename'), chunk.get('page'), chunk.get('chunk_id')
+        prev_text = by_position.get((fname, page, chunk_id - 1)) if chunk_id is not None else None
+        next_text = by_position.get((fname, page, chunk_id + 1)) if chunk_id is not None else None
+        start = _overlap(prev_text, text) if prev_text else 0
+        end = len(text) - (_overlap(text, next_text) if next_text else 0)
+        # 并入已选相邻片段时不再需要单独的来源标注
+        cost = estimate_tokens(text[start:max(start, end)]) + (0 if (prev_text or next_text) else label_tokens)
+
+        if used + cost > token_budget:
+            if selected:
+                dropped_budget += 1
+                continue
+            # 第一名单独就超出预算：按比例截断
+            keep = max(1, int(len(text) * (token_budget - label_tokens) / max(1, cost)))
+            text, cost = text[:keep], token_budget
+        selected.append((chunk, text, shingles))
+        if chunk_id is not None: by_position[(fname, page, chunk_id)] = text
+        used += cost
+
+    passages = _merge_adjacent(selected)
+    logger.info(f"📦 上下文打包: {len(chunks)} 个片段 -> {len(passages)} 段, 估算 {used}/{token_budget} tokens "
+                f"(近似重复 {dropped_dup}, 超出预算 {dropped_budget})")
+    return passages
+
+
+def _merge_adjacent(selected: list) -> list:
+    """同一文件同一页、chunk_id 连续的片段合并为一段 (去掉切分重叠)，段的分数取其中最高分"""
+    groups = {}
+    for chunk, text, _ in selected:
+        key = (chunk.get('filename'), chunk.get('page'))
+        groups.setdefault(key, []).append((chunk.get('chunk_id'), text, chunk.get('composite_score', 0)))
+
+    passages = []
+    for (fname, page), items in groups.items():
+        items.sort(key=lambda x: (x[0] is None, x[0] if x[0] is not None else 0))
+        current = None
+        for chunk_id, text, score in items:
+            if current is not None and chunk_id is not None and current.chunk_ids[-1] is not None \
+                    and chunk_id == current.chunk_ids[-1] + 1:
+                current.text += text[_overlap(current.text, text):]
+                current.chunk_ids.append(chunk_id)
+                current.score = max(current.score, score)
+                continue
+            current = PackedPassage(fname, page, chunk_id, text, score)
+            passages.append(current)
+    passages.sort(key=lambda p: p.score, reverse=True)
+    return passages
@@ -0,0 +1,120 @@
+import os
+import time
+import logging
+import hashlib
+
+import numpy as np
+
+from utils.lru_cache import LRUCache
+from utils.metrics import LatencyTracker
+
+logger = logging.getLogger("cross_encoder")
+
+# 可选依赖：ONNX Runtime 推理 + tokenizers 分词，未安装时回退到启发式重排
+try:
+    import onnxruntime as ort
+    from tokenizers import Tokenizer
+except ImportError:
+    ort = None
+    Tokenizer = None
+
+
+class CrossEncoderReranker:
+    """
+    CPU 上运行的小型 Cross-Encoder 重排模型 (ONNX Runtime)
+    - 模型目录需包含 model.onnx 与 tokenizer.json (例如导出的 bge-reranker-base)
+    - (查询, 片段) 对按 batch_size 批量推理，线程数与最大序列长度可配置
+    - 分数按 (规范化查询, 片段 id) 缓存，重复提问不再推理
+    """
+    def __init__(self, model_dir: str, max_length: int = 512, batch_size: int = 16, num_threads: int = 4,
+                 cache_size: int = 20000):
+        if ort is None:
+            raise ImportError("需要安装 onnxruntime 与 tokenizers 才能使用 Cross-Encoder 重排")
+        self.model_dir = model_dir
+        self.max_length = int(max_length)
+        self.batch_size = max(1, int(batch_size))
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = max(1, int(num_threads))
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, "model.onnx"), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_length)
+        if self.tokenizer.padding is None:
+            pad_token = next((t for t in ("[PAD]", "<pad>") if self.tokenizer.token_to_id(t) is not None), "[PAD]")
+            self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id(pad_token) or 0, pad_token=pad_token)
+
+        self.cache = LRUCache(maxsize=cache_size)
+        self.batch_latency = LatencyTracker("cross_encoder_batch")
+        logger.info(f"🧠 Cross-Encoder 已加载: {model_dir} (threads={options.intra_op_num_threads}, max_len={self.max_length}, batch={self.batch_size})")
+
+    @staticmethod
+    def _chunk_key(chunk):
+        if chunk.get('id') is not None: return chunk['id']
+        return hashlib.sha1(chunk.get('content', '').encode("utf-8")).hexdigest()
+
+    def _infer(self, query, contents):
+        encodings = self.tokenizer.encode_batch([(query, c) for c in contents])
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+        }
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        logits = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+        # 单输出为相关性 logit；双输出按二分类取正类概率
+        if logits.ndim == 2 and logits.shape[1] == 2:
+            exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+            return exp[:, 1] / exp.sum(axis=1)
+        return 1 / (1 + np.exp(-logits.reshape(-1)))
+
+    def score(self, query: str, chunks: list) -> np.ndarray:
+        """返回与 chunks 对齐的相关性概率 (0~1)"""
+        query_key = " ".join(query.split())
+        scores = np.zeros(len(chunks), dtype=np.float64)
+        pending = []
+        for i, chunk in enumerate(chunks):
+            cached = self.cache.get((query_key, self._chunk_key(chunk)))
+            if cached is None:
+                pending.append(i)
+            else:
+                scores[i] = cached
+
+        for start in range(0, len(pending), self.batch_size):
+            idx = pending[start:start + self.batch_size]
+            t0 = time.perf_counter()
+            probs = self._infer(query, [chunks[i].get('content', '') for i in idx])
+            elapsed = time.perf_counter() - t0
+            self.batch_latency.add(elapsed)
+            logger.info(f"🧠 Cross-Encoder 批次: {len(idx)} 对, {elapsed * 1000:.0f}ms")
+            for i, p in zip(idx, probs):
+                scores[i] = float(p)
+                self.cache.set((query_key, self._chunk_key(chunks[i])), float(p))
+        return scores
+
+    def metrics(self) -> dict:
+        return {"batch_latency": self.batch_latency.summary(), "cache": self.cache.stats()}
+
+
+def load_cross_encoder_from_env():
+    """根据环境变量 RERANKER_MODEL_DIR 等加载 Cross-Encoder，未配置或加载失败时返回 None"""
+    model_dir = os.getenv("RERANKER_MODEL_DIR")
+    if not model_dir: return None
+    if ort is None:
+        logger.warning("⚠️ 已配置 RERANKER_MODEL_DIR 但未安装 onnxruntime/tokenizers，使用启发式重排")
+        return None
+    try:
+        return CrossEncoderReranker(
+            model_dir,
+            max_length=int(os.getenv("RERANKER_MAX_LENGTH", "512")),
+            batch_size=int(os.getenv("RERANKER_BATCH_SIZE", "16")),
+            num_threads=int(os.getenv("RERANKER_THREADS", "4")),
+        )
+    except Exception as e:
+        logger.error(f"❌ Cross-Encoder 加载失败，使用启发式重排: {e}")
+        return None
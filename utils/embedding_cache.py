@@ -0,0 +1,114 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from array import array
+
+logger = logging.getLogger("embedding_cache")
+
+
+def normalize_text(text: str) -> str:
+    """缓存键使用的规范化文本：NFKC + 合并空白"""
+    return " ".join(unicodedata.normalize("NFKC", text or "").split())
+
+
+class EmbeddingCache:
+    """
+    持久化的内容寻址 Embedding 缓存 (SQLite)
+    - 键: sha1(模型名 + 规范化文本)
+    - 值: float32 数组的二进制
+    - 超过 max_entries 时按最近访问时间 (LRU) 淘汰
+    """
+    def __init__(self, path: str = "cache/embeddings.sqlite", max_entries: int = 200000):
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        dirname = os.path.dirname(path)
+        if dirname: os.makedirs(dirname, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT, dim INTEGER, vector BLOB, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha1(f"{model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: list) -> list:
+        """批量查询，返回与 texts 对齐的向量列表，未命中为 None"""
+        if not texts: return []
+        keys = [self.make_key(model, t) for t in texts]
+        found = {}
+        with self._lock:
+            unique_keys = list(set(keys))
+            # SQLite 单条语句的参数个数有限，分段查询
+            for start in range(0, len(unique_keys), 500):
+                part = unique_keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_access=? WHERE key=?", [(now, k) for k in found])
+                self._conn.commit()
+            results = [found.get(k) for k in keys]
+            hit_count = sum(1 for r in results if r is not None)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+        return results
+
+    def get(self, model: str, text: str):
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, texts: list, vectors: list):
+        rows = []
+        now = time.time()
+        for t, v in zip(texts, vectors):
+            if not t or not v: continue
+            rows.append((self.make_key(model, t), model, len(v), array("f", v).tobytes(), now))
+        if not rows: return
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+            self._count += self._conn.total_changes - before
+            self._evict_locked()
+            self._conn.commit()
+
+    def put(self, model: str, text: str, vector: list):
+        self.put_many(model, [text], [vector])
+
+    def _evict_locked(self):
+        overflow = self._count - self.max_entries
+        if overflow <= 0: return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+            (overflow,)
+        )
+        self._count = self.max_entries
+        logger.info(f"🧹 Embedding 缓存淘汰 {overflow} 条 (上限 {self.max_entries})")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "entries": self._count,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -6,10 +6,18 @@ import random
 import requests
 import json
 import base64
+import re
+from utils.rate_limiter import RateLimiter
+from utils.embedding_cache import EmbeddingCache
+from utils.metrics import LatencyTracker
+from utils.context_packer import pack_context
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("ernie_client")
 
+# 中日韩字符大致按 1 token/字 估算，其余字符按 4 字符/token 估算
+_CJK_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+
 class ERNIEClient:
     """
     百度 ERNIE / OpenAI 兼容客户端
@@ -19,7 +27,10 @@ class ERNIEClient:
     def __init__(self, 
                  llm_api_base=None, llm_api_key=None, llm_model=None,
                  embed_api_base=None, embed_api_key=None, embed_model=None,
-                 qps=0.8): # 默认 QPS 调低至 0.8，更安全
+                 qps=0.8, # 默认 QPS 调低至 0.8，更安全
+                 embed_batch_size=16, embed_max_batch_tokens=4096,
+                 rpm=None, tpm=None, max_inflight=4,
+                 embed_cache=None, context_token_budget=None):
         
         # === 1. LLM 配置 ===
         self.llm_base = (llm_api_base or "https://aistudio.baidu.com/llm/lmapi/v3").rstrip('/')
@@ -30,14 +41,31 @@ class ERNIEClient:
         self.embed_base = (embed_api_base or "https://aistudio.baidu.com/llm/lmapi/v3").rstrip('/')
         self.embed_key = embed_api_key or os.getenv("AISTUDIO_ACCESS_TOKEN", "")
         self.embedding_model_name = embed_model or "embedding-v1"
+        # 单次请求最多打包的文本条数与估算 token 上限
+        self.embed_batch_size = max(1, int(embed_batch_size))
+        self.embed_max_batch_tokens = max(1, int(embed_max_batch_tokens))
+
+        # === 3. Embedding 持久化缓存 (传入 False 可关闭) ===
+        self.embed_cache = None
+        if embed_cache is None:
+            try:
+                self.embed_cache = EmbeddingCache(os.getenv("EMBED_CACHE_PATH", "cache/embeddings.sqlite"))
+            except Exception as e: logger.error(f"❌ Embedding 缓存初始化异常: {e}")
+        elif embed_cache:
+            self.embed_cache = embed_cache
 
         # === 4. 速率控制 ===
         self.target_qps = float(qps) if qps > 0 else 0.8
-        self.current_delay = 1.0 / self.target_qps 
+        # 每个端点独立的令牌桶与 AIMD 状态：RPM 默认由 QPS 换算，TPM 不配置则不限制
+        request_rpm = float(rpm) if rpm else self.target_qps * 60.0
+        self.embed_limiter = RateLimiter("embedding", rpm=request_rpm, tpm=tpm, max_inflight=max_inflight)
+        self.chat_limiter = RateLimiter("chat", rpm=request_rpm, tpm=tpm, max_inflight=max_inflight)
         
-        self.last_embed_time = 0
-        self.last_chat_time = 0
         self.max_retries = 5 # 最大重试次数
+        # 流式输出的首 token 延迟 (TTFT)
+        self.ttft_tracker = LatencyTracker("chat_ttft")
+        # 问答时参考资料的估算 token 预算 (控制 prompt 长度、生成延迟与 TPM 占用)
+        self.context_token_budget = max(1, int(context_token_budget or os.getenv("CONTEXT_TOKEN_BUDGET", "6000")))
         
         # === 5. 初始化客户端 ===
         self.chat_client = None
@@ -98,108 +126,277 @@ class ERNIEClient:
         except Exception as e:
             # 抛出异常供上层 (backend.py) 捕获和处理
             raise e
-    def _wait_for_rate_limit(self, is_embedding=True):
-        """流控等待"""
-        now = time.time()
-        last_time = self.last_embed_time if is_embedding else self.last_chat_time
-        elapsed = now - last_time
-        if elapsed < self.current_delay:
-            time.sleep(self.current_delay - elapsed)
-        
-        # 更新时间戳
-        if is_embedding: self.last_embed_time = time.time()
-        else: self.last_chat_time = time.time()
+    def _rate_limited(self, is_embedding=True, tokens=1):
+        """流控：按端点获取令牌桶配额与在途名额 (线程安全)"""
+        limiter = self.embed_limiter if is_embedding else self.chat_limiter
+        return limiter.acquire(tokens)
+
+    def _estimate_message_tokens(self, messages: list) -> int:
+        """估算对话消息的 token 数 (仅统计文本部分)"""
+        total = 0
+        for m in messages:
+            content = m.get("content", "")
+            if isinstance(content, list):
+                content = " ".join(p.get("text", "") for p in content if isinstance(p, dict))
+            total += self._estimate_tokens(content)
+        return total
+
+    @staticmethod
+    def _get_retry_after(e):
+        """从异常携带的 HTTP 响应中读取 Retry-After (秒)"""
+        headers = getattr(getattr(e, "response", None), "headers", None)
+        if not headers: return None
+        try:
+            value = headers.get("retry-after") or headers.get("Retry-After")
+            return float(value) if value else None
+        except (TypeError, ValueError):
+            return None
 
-    def _adaptive_slow_down(self):
-        """触发自适应降级：遇到限流时，永久增加间隔"""
-        self.current_delay = min(self.current_delay * 2.0, 15.0) 
-        logger.warning(f"📉 触发速率限制(429)，系统自动降速: 新间隔 {self.current_delay:.2f}s")
+    def _adaptive_slow_down(self, e, is_embedding=True):
+        """触发自适应降级：遇到限流时乘性降速，之后由连续成功逐步恢复；返回 Retry-After"""
+        limiter = self.embed_limiter if is_embedding else self.chat_limiter
+        retry_after = self._get_retry_after(e)
+        limiter.record_throttle(str(e).lower(), retry_after=retry_after)
+        return retry_after
+
+    def get_rate_metrics(self) -> dict:
+        """当前各端点的有效速率等指标"""
+        return {
+            "embedding": self.embed_limiter.metrics(),
+            "chat": self.chat_limiter.metrics(),
+        }
 
     def chat(self, messages: list, model=None, max_tokens=2048, temperature=0.7):
         use_model = model if model else self.chat_model_name
-        self._wait_for_rate_limit(is_embedding=False)
 
         if not self.chat_client: return "错误: Client 未初始化"
         
         try:
-            response = self.chat_client.chat.completions.create(
-                model=use_model, messages=messages, max_tokens=max_tokens, temperature=temperature
-            )
-            self.last_chat_time = time.time()
+            with self._rate_limited(is_embedding=False, tokens=self._estimate_message_tokens(messages) + max_tokens):
+                response = self.chat_client.chat.completions.create(
+                    model=use_model, messages=messages, max_tokens=max_tokens, temperature=temperature
+                )
+            self.chat_limiter.record_success()
             content = response.choices[0].message.content
             if not content: return "模型返回内容为空"
             return content
             
         except Exception as e:
+            if self._is_rate_limit_error(e):
+                self._adaptive_slow_down(e, is_embedding=False)
             # 不要在这里只打印日志然后返回 None/Str
             logger.error(f"❌ Chat 失败: {e}")
             raise e
 
-    def get_embedding(self, text: str, max_retries: int = 5) -> list:
-        if not text: return None
-            
+    def chat_stream(self, messages: list, model=None, max_tokens=2048, temperature=0.7):
+        """
+        流式对话：逐段 yield 模型输出的增量文本，并记录首 token 延迟
+        """
+        use_model = model if model else self.chat_model_name
+
+        if not self.chat_client:
+            yield "错误: Client 未初始化"
+            return
+
+        start = time.perf_counter()
+        got_first = False
+        try:
+            # 在途名额只在建立流式请求时占用，消费输出期间不占 (否则慢速/被放弃的流会挤占翻译等其他对话请求)
+            with self._rate_limited(is_embedding=False, tokens=self._estimate_message_tokens(messages) + max_tokens):
+                stream = self.chat_client.chat.completions.create(
+                    model=use_model, messages=messages, max_tokens=max_tokens, temperature=temperature, stream=True
+                )
+            for event in stream:
+                if not event.choices: continue
+                delta = event.choices[0].delta.content
+                if not delta: continue
+                if not got_first:
+                    got_first = True
+                    ttft = time.perf_counter() - start
+                    self.ttft_tracker.add(ttft)
+                    logger.info(f"⏱️ 首 token 延迟: {ttft:.2f}s")
+                yield delta
+            self.chat_limiter.record_success()
+            if not got_first:
+                yield "模型返回内容为空"
+
+        except Exception as e:
+            if self._is_rate_limit_error(e):
+                self._adaptive_slow_down(e, is_embedding=False)
+            logger.error(f"❌ Chat(流式) 失败: {e}")
+            raise e
+
+    def get_latency_metrics(self) -> dict:
+        return {"ttft": self.ttft_tracker.summary()}
+
+    def _is_rate_limit_error(self, e) -> bool:
+        """识别千帆特定的限流错误码"""
+        error_str = str(e).lower()
+        return (
+            "429" in error_str or 
+            "rate limit" in error_str or 
+            "rpm_rate_limit_exceeded" in error_str or
+            "tpm_rate_limit_exceeded" in error_str
+        )
+
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        """粗略估算 token 数，仅用于批次切分"""
+        if not text: return 0
+        cjk = len(_CJK_PATTERN.findall(text))
+        return cjk + (len(text) - cjk) // 4 + 1
+
+    def _request_embeddings(self, texts: list, max_retries: int = 5) -> list:
+        """
+        单次请求一批文本的向量，结果按输入顺序返回。
+        限流时退避重试；批量请求遇到其他错误直接抛出，由调用方拆分重试。
+        """
+        last_error = None
         for attempt in range(max_retries):
             try:
-                self._wait_for_rate_limit(is_embedding=True)
-                
-                # === 分支 B: OpenAI 兼容模式 ===
-                if self.embed_client:
+                tokens = sum(self._estimate_tokens(t) for t in texts)
+                with self._rate_limited(is_embedding=True, tokens=tokens):
                     response = self.embed_client.embeddings.create(
-                        model=self.embedding_model_name, input=[text]
+                        model=self.embedding_model_name, input=texts
                     )
-                    self.last_embed_time = time.time()
-                    if response and response.data:
-                        return response.data[0].embedding
+                self.embed_limiter.record_success()
+                data = sorted(response.data, key=lambda d: d.index) if response and response.data else []
+                if len(data) != len(texts):
+                    raise ValueError(f"返回向量数量不匹配 ({len(data)}/{len(texts)})")
+                return [d.embedding for d in data]
 
             except Exception as e:
-                error_str = str(e).lower()
-                
-                # 🌟 核心逻辑：识别千帆特定的限流错误码
-                is_rate_limit = (
-                    "429" in error_str or 
-                    "rate limit" in error_str or 
-                    "rpm_rate_limit_exceeded" in error_str or
-                    "tpm_rate_limit_exceeded" in error_str
-                )
-                
-                if is_rate_limit:
-                    self._adaptive_slow_down() # 永久降速
+                last_error = e
+                if self._is_rate_limit_error(e):
+                    retry_after = self._adaptive_slow_down(e, is_embedding=True)
                     
-                    # 本次避让 (指数退避)
-                    wait_time = (2 ** attempt) + random.uniform(1.0, 3.0)
-                    logger.warning(f"⚠️ 触发限流保护，避让 {wait_time:.1f}s (尝试 {attempt + 1}/{max_retries})")
-                    time.sleep(wait_time)
+                    # 本次避让：有 Retry-After 时令牌桶已暂停相应时长，否则指数退避
+                    if not retry_after:
+                        wait_time = (2 ** attempt) + random.uniform(1.0, 3.0)
+                        logger.warning(f"⚠️ 触发限流保护，避让 {wait_time:.1f}s (尝试 {attempt + 1}/{max_retries})")
+                        time.sleep(wait_time)
+                elif len(texts) > 1:
+                    raise
                 else:
                     logger.warning(f"⚠️ Embedding 异常 (尝试 {attempt + 1}): {e}")
                     time.sleep(1)
-        
-        logger.error("❌ Embedding 最终失败")
-        return None
+        raise last_error or RuntimeError("Embedding 请求失败")
+
+    def _cache_lookup(self, texts: list) -> list:
+        if not self.embed_cache: return [None] * len(texts)
+        try:
+            return self.embed_cache.get_many(self.embedding_model_name, texts)
+        except Exception as e:
+            logger.warning(f"⚠️ Embedding 缓存读取失败: {e}")
+            return [None] * len(texts)
+
+    def _cache_store(self, texts: list, vectors: list):
+        if not self.embed_cache: return
+        try:
+            self.embed_cache.put_many(self.embedding_model_name, texts, vectors)
+        except Exception as e:
+            logger.warning(f"⚠️ Embedding 缓存写入失败: {e}")
+
+    def _embed_single(self, text: str, max_retries: int = 5) -> list:
+        try:
+            return self._request_embeddings([text], max_retries=max_retries)[0]
+        except Exception as e:
+            logger.error(f"❌ Embedding 最终失败: {e}")
+            return None
+
+    def get_embedding(self, text: str, max_retries: int = 5) -> list:
+        if not text: return None
+        cached = self._cache_lookup([text])[0]
+        if cached: return cached
+        if not self.embed_client:
+            logger.error("❌ Embedding Client 未初始化")
+            return None
 
-    def get_embeddings(self, texts: list) -> list:
-        """批量获取"""
+        emb = self._embed_single(text, max_retries=max_retries)
+        if emb: self._cache_store([text], [emb])
+        return emb
+
+    def _embed_batch(self, texts: list) -> list:
+        """
+        请求一个批次；非限流错误时二分拆分重试，直到定位到单条失败的文本。
+        重试耗尽后仍被限流时直接放弃本批 (返回 None)，拆分只会成倍增加请求量
+        """
+        if len(texts) == 1:
+            return [self._embed_single(texts[0])]
+        try:
+            return self._request_embeddings(texts)
+        except Exception as e:
+            if self._is_rate_limit_error(e):
+                logger.error(f"❌ 批量 Embedding 持续限流，放弃本批 ({len(texts)} 条): {e}")
+                return [None] * len(texts)
+            mid = len(texts) // 2
+            logger.warning(f"⚠️ 批量 Embedding 失败 ({len(texts)} 条)，拆分重试: {e}")
+            return self._embed_batch(texts[:mid]) + self._embed_batch(texts[mid:])
+
+    def _plan_embed_batches(self, texts: list, indices: list, batch_size: int) -> list:
+        """按条数与 token 预算把待请求的下标切分成若干批次"""
+        batches, current, current_tokens = [], [], 0
+        for i in indices:
+            tokens = self._estimate_tokens(texts[i])
+            if current and (len(current) >= batch_size or current_tokens + tokens > self.embed_max_batch_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current: batches.append(current)
+        return batches
+
+    def get_embeddings(self, texts: list, batch_size: int = None) -> list:
+        """
+        批量获取：先查缓存，未命中的文本打包进一次请求，输出顺序与输入一致，失败项为 None
+        """
         if not texts: return []
-        results = []
-        for t in texts:
-            emb = self.get_embedding(t)
-            results.append(emb)
+        results = [None] * len(texts)
+        candidates = [i for i, t in enumerate(texts) if t]
+        for i, emb in zip(candidates, self._cache_lookup([texts[i] for i in candidates])):
+            results[i] = emb
+        pending = [i for i in candidates if results[i] is None]
+        if not pending: return results
+        if not self.embed_client:
+            logger.error("❌ Embedding Client 未初始化")
+            return results
+
+        batch_size = max(1, int(batch_size or self.embed_batch_size))
+        for batch in self._plan_embed_batches(texts, pending, batch_size):
+            batch_texts = [texts[i] for i in batch]
+            vectors = self._embed_batch(batch_texts)
+            for i, emb in zip(batch, vectors):
+                results[i] = emb
+            self._cache_store(batch_texts, vectors)
         return results
     
     get_embeddings_batch = get_embeddings
 
-    def answer_question(self, question: str, context_chunks: list) -> str:
+    def _build_answer_prompt(self, question: str, context_chunks: list) -> str:
         if not context_chunks:
             prompt = f"用户问题：{question}"
         else:
-            context_str = ""
-            for i, chunk in enumerate(context_chunks):
-                content = chunk.get('content', '').replace('\n', ' ')[:800]
-                fname = chunk.get('filename', '未知文档')
-                page = chunk.get('page', 0)
-                context_str += f"[参考资料{i+1} ({fname} P{page})]: {content}\n\n"
+            # 按 token 预算打包：同页相邻片段合并、近似重复去除、按重排分数贪心填充
+            passages = pack_context(context_chunks, self.context_token_budget, self._estimate_tokens)
+            parts = []
+            for i, passage in enumerate(passages):
+                content = passage.text.replace('\n', ' ')
+                fname = passage.filename or '未知文档'
+                page = passage.page or 0
+                parts.append(f"[参考资料{i+1} ({fname} P{page})]: {content}\n\n")
+            context_str = "".join(parts)
             prompt = f"基于以下参考资料回答问题：\n\n[参考资料]:\n{context_str}\n\n[用户问题]:\n{question}"
+        return prompt
+
+    def answer_question(self, question: str, context_chunks: list) -> str:
+        prompt = self._build_answer_prompt(question, context_chunks)
         return self.chat([{"role": "user", "content": prompt}]) or "生成回答失败"
 
+    def answer_question_stream(self, question: str, context_chunks: list):
+        """answer_question 的流式版本，yield 增量文本"""
+        prompt = self._build_answer_prompt(question, context_chunks)
+        yield from self.chat_stream([{"role": "user", "content": prompt}])
+
     def generate_summary(self, text: str) -> str:
         if not text: return "无内容"
         prompt = f"请对以下文档内容生成一份精简摘要（200字以内）：\n\n{text[:5000]}"
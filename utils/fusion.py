@@ -0,0 +1,84 @@
+import os
+import json
+import logging
+
+import numpy as np
+
+logger = logging.getLogger("fusion")
+
+FUSION_METHODS = ("rrf", "weighted", "minmax", "zscore")
+
+# 默认: RRF，向量召回权重 4，关键词召回权重 1
+DEFAULT_FUSION_CONFIG = {"method": "rrf", "weights": {"dense": 4.0, "keyword": 1.0}, "k": 60}
+
+
+def resolve_fusion_config(fusion_config=None, collection_name=None):
+    """
+    融合配置优先级: 构造参数 > 环境变量 FUSION_CONFIG 中该集合的配置 > FUSION_CONFIG 中的 "*" > 默认
+    FUSION_CONFIG 为 JSON，例如 {"*": {"method": "rrf"}, "kb_xxx": {"method": "minmax", "weights": {"dense": 0.7, "keyword": 0.3}}}
+    """
+    config = {**DEFAULT_FUSION_CONFIG, "weights": dict(DEFAULT_FUSION_CONFIG["weights"])}
+    layers = []
+    env_value = os.getenv("FUSION_CONFIG")
+    if env_value:
+        try:
+            env_config = json.loads(env_value)
+            layers += [env_config.get("*"), env_config.get(collection_name)]
+        except ValueError as e:
+            logger.warning(f"⚠️ FUSION_CONFIG 解析失败，使用默认融合配置: {e}")
+    layers.append(fusion_config)
+    for layer in layers:
+        if not layer: continue
+        config.update({k: v for k, v in layer.items() if k != "weights"})
+        config["weights"].update(layer.get("weights") or {})
+    if config["method"] not in FUSION_METHODS:
+        raise ValueError(f"不支持的融合方式: {config['method']} (可选 {', '.join(FUSION_METHODS)})")
+    return config
+
+
+def _normalize(scores, method):
+    if len(scores) == 0: return scores
+    if method == "minmax":
+        lo, hi = scores.min(), scores.max()
+        return np.ones_like(scores) if hi == lo else (scores - lo) / (hi - lo)
+    if method == "zscore":
+        std = scores.std()
+        return np.zeros_like(scores) if std == 0 else (scores - scores.mean()) / std
+    return scores
+
+
+def fuse(legs, method="rrf", weights=None, k=60, top_k=None):
+    """
+    多路召回融合
+    legs: {名称: (主键数组, 分数数组)}，每路按相关性降序排列，分数越大越相关
+    method: rrf (按名次) / weighted (原始分数加权) / minmax、zscore (每路归一化后加权)
+    返回 (主键数组, 融合分数数组)，按融合分数降序，同分时按首次出现的顺序
+    """
+    weights = weights or {}
+    all_ids, contributions = [], []
+    for name, (ids, scores) in legs.items():
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0: continue
+        weight = float(weights.get(name, 1.0))
+        if method == "rrf":
+            contrib = weight / (k + np.arange(len(ids), dtype=np.float64))
+        else:
+            contrib = weight * _normalize(np.asarray(scores, dtype=np.float64), method)
+        all_ids.append(ids)
+        contributions.append(contrib)
+    if not all_ids:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    ids = np.concatenate(all_ids)
+    unique_ids, inverse = np.unique(ids, return_inverse=True)
+    fused = np.bincount(inverse, weights=np.concatenate(contributions), minlength=len(unique_ids))
+    first_seen = np.full(len(unique_ids), len(ids), dtype=np.int64)
+    np.minimum.at(first_seen, inverse, np.arange(len(ids)))
+
+    # 只对前 top_k 做部分选择，再对这一小段排序
+    if top_k is not None and 0 < top_k < len(unique_ids):
+        candidates = np.argpartition(-fused, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(len(unique_ids))
+    order = candidates[np.lexsort((first_seen[candidates], -fused[candidates]))]
+    return unique_ids[order], fused[order]
@@ -0,0 +1,88 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger("image_downloader")
+
+
+class ImageDownloader:
+    """
+    并发图片下载器
+    - 共享 requests.Session，按主机复用连接池
+    - 有界的下载线程数
+    - 连接错误与 429/5xx 自动指数退避重试
+    """
+    def __init__(self, max_workers=8, retries=3, backoff=0.5, timeout=30):
+        self.max_workers = max(1, int(max_workers))
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries, backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET",)
+        )
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _fetch(self, key, url, dest=None):
+        """dest 为空时返回 bytes；否则分块流式写入 dest (先写 .part 再原子替换) 并返回路径"""
+        start = time.perf_counter()
+        try:
+            with self.session.get(url, timeout=self.timeout, stream=dest is not None) as resp:
+                if resp.status_code != 200:
+                    return key, None, 0, time.perf_counter() - start, f"HTTP {resp.status_code}"
+                if dest is None:
+                    return key, resp.content, len(resp.content), time.perf_counter() - start, None
+                nbytes = 0
+                tmp_path = f"{dest}.part"
+                with open(tmp_path, "wb") as f:
+                    for block in resp.iter_content(chunk_size=64 * 1024):
+                        f.write(block)
+                        nbytes += len(block)
+                os.replace(tmp_path, dest)
+                return key, dest, nbytes, time.perf_counter() - start, None
+        except Exception as e:
+            if dest is not None and os.path.exists(f"{dest}.part"):
+                try: os.remove(f"{dest}.part")
+                except OSError: pass
+            return key, None, 0, time.perf_counter() - start, str(e)
+
+    def download_many(self, tasks):
+        """
+        tasks: [(key, url)] 或 [(key, url, 保存路径)]
+        返回 ({key: bytes 或 保存路径}, report)，下载失败的 key 不在结果中，report 含字节数与延迟统计
+        """
+        results, failures, latencies = {}, [], []
+        total_bytes = 0
+        start = time.perf_counter()
+        if tasks:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(tasks)), thread_name_prefix="img_dl") as pool:
+                for key, content, nbytes, elapsed, error in pool.map(lambda t: self._fetch(*t), tasks):
+                    latencies.append(elapsed)
+                    if content is None:
+                        failures.append((key, error))
+                        continue
+                    results[key] = content
+                    total_bytes += nbytes
+
+        for key, error in failures:
+            logger.warning(f"⚠️ 图片下载失败 {key}: {error}")
+        latencies.sort()
+        report = {
+            "count": len(tasks),
+            "ok": len(results),
+            "failed": len(failures),
+            "bytes": total_bytes,
+            "seconds": round(time.perf_counter() - start, 3),
+            "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else 0.0,
+            "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        }
+        return results, report
+
+    def close(self):
+        self.session.close()
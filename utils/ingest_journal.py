@@ -0,0 +1,222 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+
+logger = logging.getLogger("ingest_journal")
+
+# 页面所处的入库阶段
+STAGE_OCR = 1        # 已解析并切分
+STAGE_EMBEDDED = 2   # 已向量化
+STAGE_INSERTED = 3   # 已写入 Milvus (提交点)
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """分块计算文件内容哈希，不把整个文件读入内存"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def chunk_hash(text: str) -> str:
+    """片段正文的内容哈希 (NFKC + 合并空白后取 sha1)，用于跨页/跨文件复用向量"""
+    normalized = " ".join(unicodedata.normalize("NFKC", text or "").split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+class IngestJournal:
+    """
+    入库断点日志 (SQLite，每个集合一份)
+    - files: 文件名 -> 内容哈希 / 总页数 / 状态 (ingesting, partial, complete)
+    - pages: 每页所处阶段 (OCR / 向量化 / 已写入) 与分配的 chunk_id 区间
+    - chunks: 片段正文哈希 -> Milvus 主键，用于去重时复用已有向量
+    中途退出后重新上传同一文件，只需处理未写入的页；内容哈希变化时视为新文件
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        dirname = os.path.dirname(path)
+        if dirname: os.makedirs(dirname, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "filename TEXT PRIMARY KEY, content_hash TEXT, total_pages INTEGER, status TEXT, updated_at REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "filename TEXT, page INTEGER, stage INTEGER, first_chunk INTEGER, n_chunks INTEGER, "
+            "PRIMARY KEY (filename, page))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (text_hash TEXT, pk INTEGER PRIMARY KEY, filename TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_hash ON chunks(text_hash)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_hash ON files(content_hash)")
+        self._conn.commit()
+
+    def file_state(self, filename: str):
+        """返回 {content_hash, total_pages, status}，无记录时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash, total_pages, status FROM files WHERE filename=?", (filename,)
+            ).fetchone()
+        if row is None: return None
+        return {"content_hash": row[0], "total_pages": row[1], "status": row[2]}
+
+    def start_file(self, filename: str, content_hash: str):
+        """登记 (或续传) 一个文件；内容哈希变化时清空旧的页记录"""
+        with self._lock:
+            row = self._conn.execute("SELECT content_hash FROM files WHERE filename=?", (filename,)).fetchone()
+            if row is not None and row[0] != content_hash:
+                self._conn.execute("DELETE FROM pages WHERE filename=?", (filename,))
+                row = None
+            if row is None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, NULL, 'ingesting', ?)", (filename, content_hash, time.time())
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE files SET status='ingesting', updated_at=? WHERE filename=?", (time.time(), filename)
+                )
+            self._conn.commit()
+
+    def set_total_pages(self, filename: str, total_pages: int):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE files SET total_pages=?, updated_at=? WHERE filename=?", (int(total_pages), time.time(), filename)
+            )
+            self._conn.commit()
+
+    def record_chunks(self, filename: str, page_chunks: dict):
+        """page_chunks: {页码: (起始 chunk_id, 片段数)}，标记为已切分；片段数为 0 的空白页直接视为已写入"""
+        rows = [(filename, int(p), STAGE_INSERTED if n == 0 else STAGE_OCR, int(first), int(n))
+                for p, (first, n) in page_chunks.items()]
+        if not rows: return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def mark_pages(self, filename: str, pages, stage: int):
+        pages = [int(p) for p in pages]
+        if not pages: return
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE pages SET stage=? WHERE filename=? AND page=? AND stage<?",
+                [(stage, filename, p, stage) for p in pages]
+            )
+            self._conn.commit()
+
+    def page_chunks(self, filename: str) -> dict:
+        """返回 {页码: (阶段, 起始 chunk_id, 片段数)}"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT page, stage, first_chunk, n_chunks FROM pages WHERE filename=?", (filename,)
+            ).fetchall()
+        return {page: (stage, first, n) for page, stage, first, n in rows}
+
+    def inserted_pages(self, filename: str) -> set:
+        return {p for p, (stage, _, _) in self.page_chunks(filename).items() if stage >= STAGE_INSERTED}
+
+    def finish_file(self, filename: str) -> bool:
+        """所有页均已写入时标记为 complete 并返回 True，否则标记为 partial"""
+        state = self.file_state(filename)
+        if state is None: return False
+        done = self.inserted_pages(filename)
+        total = state["total_pages"]
+        complete = total is not None and all(p in done for p in range(total))
+        with self._lock:
+            self._conn.execute(
+                "UPDATE files SET status=?, updated_at=? WHERE filename=?",
+                ("complete" if complete else "partial", time.time(), filename)
+            )
+            self._conn.commit()
+        return complete
+
+    def mark_complete(self, filename: str, content_hash: str):
+        """登记无页级记录但已确认入库的文件 (例如日志启用之前上传的文件)"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, NULL, 'complete', ?)", (filename, content_hash, time.time())
+            )
+            self._conn.commit()
+
+    def status(self, filename: str) -> dict:
+        """精确的入库状态: {status, total_pages, inserted_pages, complete}"""
+        state = self.file_state(filename)
+        if state is None:
+            return {"status": "unknown", "total_pages": None, "inserted_pages": 0, "complete": False}
+        done = self.inserted_pages(filename)
+        return {
+            "status": state["status"],
+            "total_pages": state["total_pages"],
+            "inserted_pages": len(done),
+            "complete": state["status"] == "complete",
+        }
+
+    def find_complete_file(self, content_hash: str, exclude: str = None):
+        """查找内容哈希相同且已完整入库的其他文件，返回文件名或 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT filename FROM files WHERE content_hash=? AND status='complete' AND filename!=? LIMIT 1",
+                (content_hash, exclude or "")
+            ).fetchone()
+        return row[0] if row else None
+
+    def copy_file(self, src: str, dst: str):
+        """把 src 的页记录复制为 dst (文件级去重时使用)，dst 标记为 complete"""
+        with self._lock:
+            self._conn.execute("DELETE FROM pages WHERE filename=?", (dst,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files SELECT ?, content_hash, total_pages, 'complete', ? FROM files WHERE filename=?",
+                (dst, time.time(), src)
+            )
+            self._conn.execute(
+                "INSERT INTO pages SELECT ?, page, stage, first_chunk, n_chunks FROM pages WHERE filename=?", (dst, src)
+            )
+            self._conn.commit()
+
+    def lookup_chunks(self, text_hashes: list) -> dict:
+        """返回 {正文哈希: Milvus 主键}，只包含已入库的哈希"""
+        unique = list({h for h in text_hashes if h})
+        found = {}
+        with self._lock:
+            for start in range(0, len(unique), 500):
+                part = unique[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, pk FROM chunks WHERE text_hash IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def record_chunk_pks(self, rows: list):
+        """rows: [(正文哈希, Milvus 主键, 文件名)]"""
+        rows = [(h, int(pk), fname) for h, pk, fname in rows if h]
+        if not rows: return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def remove_chunk_pks(self, pks: list):
+        pks = [int(pk) for pk in pks]
+        if not pks: return
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE pk=?", [(pk,) for pk in pks])
+            self._conn.commit()
+
+    def remove_file(self, filename: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks WHERE filename=?", (filename,))
+            self._conn.execute("DELETE FROM pages WHERE filename=?", (filename,))
+            self._conn.execute("DELETE FROM files WHERE filename=?", (filename,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,116 @@
+import queue
+import logging
+import threading
+
+logger = logging.getLogger("ingest_pipeline")
+
+_STOP = object()
+
+
+class PipelineStage:
+    """
+    流水线的一个阶段
+    func(item, emit): 处理一个输入，调用 emit(out) 向下游输出 0~N 个结果
+    """
+    def __init__(self, name, func, workers=1, queue_size=4):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+
+
+class IngestPipeline:
+    """
+    分阶段的生产者/消费者流水线
+    - 每个阶段有独立的工作线程数
+    - 阶段之间是有界队列：下游处理不过来时上游 put 阻塞 (背压)
+    - counters 记录每个阶段的 输入/输出/错误/处理中 数量，messages 收集各阶段的日志，供进度展示
+    """
+    def __init__(self, stages):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=s.queue_size) for s in stages]
+        self.counters = {s.name: {"in": 0, "out": 0, "errors": 0, "busy": 0} for s in stages}
+        self.messages = queue.Queue()
+        self._alive = [s.workers for s in stages]
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+
+    @property
+    def done(self):
+        return self._finished.is_set()
+
+    def log(self, msg):
+        self.messages.put(msg)
+
+    def drain_messages(self):
+        """取出当前所有待展示的日志"""
+        out = []
+        while True:
+            try: out.append(self.messages.get_nowait())
+            except queue.Empty: return "".join(out)
+
+    def cancel(self):
+        """取消：停止投喂，各阶段丢弃剩余输入后退出"""
+        self._cancel.set()
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def start(self, items):
+        for idx, stage in enumerate(self.stages):
+            for w in range(stage.workers):
+                threading.Thread(target=self._worker, args=(idx,), name=f"{stage.name}-{w}", daemon=True).start()
+        threading.Thread(target=self._feed, args=(items,), name="pipeline-feeder", daemon=True).start()
+
+    def _put(self, idx, item):
+        # 队列满时阻塞等待 (背压)，取消后放弃
+        while not self._cancel.is_set():
+            try:
+                self.queues[idx].put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _feed(self, items):
+        try:
+            for item in items:
+                if not self._put(0, item): break
+        finally:
+            for _ in range(self.stages[0].workers):
+                self.queues[0].put(_STOP)
+
+    def _worker(self, idx):
+        stage = self.stages[idx]
+        counter = self.counters[stage.name]
+        is_last = idx == len(self.stages) - 1
+        emit = (lambda out: None) if is_last else (lambda out: self._put(idx + 1, out))
+
+        while True:
+            item = self.queues[idx].get()
+            if item is _STOP: break
+            if self._cancel.is_set(): continue
+            with self._lock:
+                counter["in"] += 1
+                counter["busy"] += 1
+            try:
+                stage.func(item, emit)
+                with self._lock: counter["out"] += 1
+            except Exception as e:
+                with self._lock: counter["errors"] += 1
+                logger.exception(f"[{stage.name}] 处理失败")
+                self.log(f"❌ [{stage.name}] 处理失败: {e}\n")
+            finally:
+                with self._lock: counter["busy"] -= 1
+
+        # 本阶段最后一个线程退出时，通知下游结束
+        with self._lock:
+            self._alive[idx] -= 1
+            last_worker = self._alive[idx] == 0
+        if last_worker:
+            if is_last:
+                self._finished.set()
+            else:
+                for _ in range(self.stages[idx + 1].workers):
+                    self.queues[idx + 1].put(_STOP)
@@ -0,0 +1,106 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class LRUCache:
+    """
+    线程安全的内存 LRU 缓存，支持 TTL 过期与命中率统计
+    get_or_compute() 会把并发的相同 key 请求合并为一次计算 (single-flight)
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl) if ttl else None
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._data = OrderedDict()  # key -> (value, expire_at)
+        self._inflight = {}         # key -> Future
+        self._lock = threading.Lock()
+
+    def _get_locked(self, key):
+        item = self._data.get(key)
+        if item is None: return None
+        value, expire_at = item
+        if expire_at is not None and expire_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return item
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._get_locked(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._set_locked(key, value)
+
+    def _set_locked(self, key, value):
+        expire_at = time.monotonic() + self.ttl if self.ttl else None
+        self._data[key] = (value, expire_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """命中直接返回；未命中时只有一个线程执行 compute，其余线程等待同一结果。结果为 None 时不缓存"""
+        with self._lock:
+            item = self._get_locked(key)
+            if item is not None:
+                self.hits += 1
+                return item[0]
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                owner = False
+            else:
+                self.misses += 1
+                future = Future()
+                self._inflight[key] = future
+                owner = True
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except Exception as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            if value is not None:
+                self._set_locked(key, value)
+            self._inflight.pop(key, None)
+        future.set_result(value)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[0] if item else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": len(self._data),
+        }
@@ -0,0 +1,37 @@
+import threading
+from collections import deque
+
+
+class LatencyTracker:
+    """
+    滑动窗口延迟统计 (秒)，线程安全
+    用于首 token 延迟、检索延迟等指标的 p50/p95 报告
+    """
+    def __init__(self, name: str, window: int = 512):
+        self.name = name
+        self.count = 0
+        self._samples = deque(maxlen=max(1, int(window)))
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(float(seconds))
+            self.count += 1
+
+    def percentile(self, p: float) -> float:
+        with self._lock:
+            data = sorted(self._samples)
+        if not data: return 0.0
+        idx = min(len(data) - 1, max(0, int(round(p / 100.0 * (len(data) - 1)))))
+        return data[idx]
+
+    def summary(self) -> dict:
+        with self._lock:
+            last = self._samples[-1] if self._samples else 0.0
+        return {
+            "name": self.name,
+            "count": self.count,
+            "p50": round(self.percentile(50), 4),
+            "p95": round(self.percentile(95), 4),
+            "last": round(last, 4),
+        }
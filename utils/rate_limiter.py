@@ -0,0 +1,155 @@
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager, asynccontextmanager
+
+logger = logging.getLogger("rate_limiter")
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶
+    采用“预约”方式扣减：允许余额为负，调用方按返回的等待时间 sleep，保证先到先得
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = max(float(rate), 1e-6)  # 每秒补充的令牌数
+        self.capacity = max(float(capacity or 1.0), 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """扣减 amount 个令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= amount
+            if self.tokens >= 0: return 0.0
+            return -self.tokens / self.rate
+
+    def drain(self, pause: float = 0.0):
+        """清空余额（服务端已判定超限时使用），pause 秒内不再发放令牌"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, -pause * self.rate)
+
+    def set_rate(self, rate: float):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(float(rate), 1e-6)
+
+
+class AIMDController:
+    """
+    加性增 / 乘性减 (AIMD) 速率控制器
+    - 连续成功 success_threshold 次后，速率增加 increase_step，直到回到目标速率
+    - 遇到限流时速率乘以 decrease_factor，最低不低于 min_rate
+    """
+    def __init__(self, target_rate: float, min_rate: float = 1.0 / 15.0,
+                 increase_step: float = None, decrease_factor: float = 0.5, success_threshold: int = 5):
+        self.target_rate = float(target_rate)
+        self.min_rate = min(float(min_rate), self.target_rate)
+        self.increase_step = float(increase_step) if increase_step else self.target_rate * 0.1
+        self.decrease_factor = float(decrease_factor)
+        self.success_threshold = max(1, int(success_threshold))
+        self.rate = self.target_rate
+        self.success_streak = 0
+        self.throttle_count = 0
+        self._lock = threading.Lock()
+
+    def on_success(self) -> float:
+        with self._lock:
+            self.success_streak += 1
+            if self.success_streak >= self.success_threshold and self.rate < self.target_rate:
+                self.rate = min(self.target_rate, self.rate + self.increase_step)
+                self.success_streak = 0
+            return self.rate
+
+    def on_throttle(self) -> float:
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self.success_streak = 0
+            self.throttle_count += 1
+            return self.rate
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "effective_qps": round(self.rate, 4),
+                "target_qps": round(self.target_rate, 4),
+                "success_streak": self.success_streak,
+                "throttle_count": self.throttle_count,
+            }
+
+
+class RateLimiter:
+    """
+    单个端点的限流器：RPM 令牌桶 + 可选 TPM 令牌桶 + 在途请求数上限
+    同步调用使用 acquire()，协程使用 acquire_async()
+    请求速率由 AIMDController 动态调节：成功时逐步恢复，限流时减半
+    """
+    def __init__(self, name: str, rpm: float, tpm: float = None, max_inflight: int = 4, burst: float = 1.0):
+        self.name = name
+        self.rpm = float(rpm)
+        self.tpm = float(tpm) if tpm else None
+        self.max_inflight = max(1, int(max_inflight))
+        self._request_bucket = TokenBucket(self.rpm / 60.0, capacity=burst)
+        self._token_bucket = TokenBucket(self.tpm / 60.0, capacity=self.tpm) if self.tpm else None
+        self._inflight = threading.BoundedSemaphore(self.max_inflight)
+        self.controller = AIMDController(self.rpm / 60.0)
+
+    def _reserve(self, tokens: float) -> float:
+        wait = self._request_bucket.reserve(1.0)
+        if self._token_bucket:
+            wait = max(wait, self._token_bucket.reserve(max(float(tokens), 1.0)))
+        return wait
+
+    @contextmanager
+    def acquire(self, tokens: float = 1.0):
+        self._inflight.acquire()
+        try:
+            wait = self._reserve(tokens)
+            if wait > 0: time.sleep(wait)
+            yield
+        finally:
+            self._inflight.release()
+
+    @asynccontextmanager
+    async def acquire_async(self, tokens: float = 1.0):
+        await asyncio.to_thread(self._inflight.acquire)
+        try:
+            wait = self._reserve(tokens)
+            if wait > 0: await asyncio.sleep(wait)
+            yield
+        finally:
+            self._inflight.release()
+
+    def record_success(self):
+        old_rate = self.controller.rate
+        new_rate = self.controller.on_success()
+        if new_rate != old_rate:
+            self._request_bucket.set_rate(new_rate)
+            logger.info(f"📈 [{self.name}] 速率恢复: {new_rate:.2f} QPS")
+
+    def record_throttle(self, error_str: str = "", retry_after: float = None):
+        """
+        服务端返回限流时：清空对应的桶 (有 Retry-After 则暂停相应时长)，并乘性降速
+        """
+        pause = float(retry_after) if retry_after else 0.0
+        new_rate = self.controller.on_throttle()
+        self._request_bucket.set_rate(new_rate)
+        if "tpm_rate_limit_exceeded" in error_str and self._token_bucket:
+            self._token_bucket.drain(pause)
+        else:
+            self._request_bucket.drain(pause)
+        logger.warning(f"📉 [{self.name}] 触发速率限制(429)，自动降速: {new_rate:.2f} QPS" + (f"，等待 Retry-After {pause:.1f}s" if pause else ""))
+
+    def metrics(self) -> dict:
+        data = self.controller.metrics()
+        data.update({"endpoint": self.name, "max_inflight": self.max_inflight, "tpm": self.tpm})
+        return data
@@ -1,125 +1,157 @@
 import logging
 from typing import List, Dict, Any, Tuple
-from fuzzywuzzy import fuzz
 import re
 
+import numpy as np
+from rapidfuzz import fuzz, process as rf_process
+
 logger = logging.getLogger("pdf_qa")
 
+# === 预编译的正则与停用词 (模块级，避免每个候选重复编译) ===
+STOP_WORDS = {
+    '的', '了', '是', '在', '和', '与', '或', '等', '中', '上', '下',
+    '为', '有', '以', '及', '将', '对', '从', '到', '由', '被', '把',
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for'
+}
+_EN_WORD = re.compile(r'\b[a-zA-Z]{2,}\b')
+_EN_PROPER = re.compile(r'\b[A-Z][a-z]+\b|[A-Z]{2,}')
+_ZH_SPLIT = re.compile(r'[^\u4e00-\u9fa5]')
+
+
+class QueryFeatures:
+    """查询侧特征：每次请求只计算一次，所有候选共用"""
+    __slots__ = ("query", "cjk_keywords", "en_keywords", "en_keyword_pattern", "n_keywords", "proper_nouns")
+
+    def __init__(self, query: str):
+        self.query = query
+        self.cjk_keywords = {c for c in query if '\u4e00' <= c <= '\u9fff' and c not in STOP_WORDS}
+        self.en_keywords = {w for w in _EN_WORD.findall(query.lower()) if w not in STOP_WORDS}
+        self.n_keywords = len(self.cjk_keywords) + len(self.en_keywords)
+        self.en_keyword_pattern = re.compile(
+            r'\b(' + '|'.join(map(re.escape, self.en_keywords)) + r')\b', re.IGNORECASE
+        ) if self.en_keywords else None
+
+        # 专有名词：英文大写词/缩写 + 长度>=2 的中文连续片段，先做子串预筛，命中后再用正则确认词边界
+        self.proper_nouns = []
+        for noun in set(_EN_PROPER.findall(query)):
+            boundary = rf'(?<![A-Za-z]){re.escape(noun)}(?![A-Za-z])' if noun.isupper() else rf'\b{re.escape(noun)}\b'
+            self.proper_nouns.append((noun, re.compile(boundary)))
+        for word in {w for w in _ZH_SPLIT.split(query) if len(w) >= 2}:
+            self.proper_nouns.append((word, re.compile(rf'(?<![\u4e00-\u9fa5]){re.escape(word)}(?![\u4e00-\u9fa5])')))
+
+    def keyword_hits(self, content: str) -> int:
+        hits = sum(1 for c in self.cjk_keywords if c in content)
+        if self.en_keyword_pattern is not None:
+            hits += len({m.lower() for m in self.en_keyword_pattern.findall(content)})
+        return hits
+
+    def has_proper_noun(self, content: str) -> bool:
+        return any(noun in content and pattern.search(content) for noun, pattern in self.proper_nouns)
+
+
 class RerankerAndFilterV2:
     """
     Reranker V2
+    启发式综合打分 (向量化实现)：模糊匹配由 rapidfuzz 一次批量计算，其余分量为 NumPy 数组运算
+    配置了 cross_encoder 时，对启发式排序的前 rerank_top_n 个候选用 Cross-Encoder 精排；推理失败时退回启发式结果
     """
-    def __init__(self):
-        self.use_paddlenlp = False
-
-    def _extract_keywords(self, text: str) -> set:
-        """提取文本关键词（去除停用词）"""
-        stop_words = {
-            '的', '了', '是', '在', '和', '与', '或', '等', '中', '上', '下', 
-            '为', '有', '以', '及', '将', '对', '从', '到', '由', '被', '把',
-            'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for'
-        }
-        
-        words = set()
-        for char in text:
-            if '\u4e00' <= char <= '\u9fff' and char not in stop_words:
-                words.add(char)
-        
-        english_words = re.findall(r'\b[a-zA-Z]{2,}\b', text.lower())
-        words.update([w for w in english_words if w not in stop_words])
-        
-        return words
+    def __init__(self, cross_encoder=None, rerank_top_n: int = 40):
+        self.cross_encoder = cross_encoder
+        self.rerank_top_n = max(1, int(rerank_top_n))
 
-    def _calculate_composite_score(self, query: str, chunk: Dict[str, Any]) -> float:
+    def _score_batch(self, query: str, chunks: List[Dict[str, Any]]) -> np.ndarray:
         """
-        综合打分算法 (Robust Version)
+        综合打分算法 (Robust Version)，对全部候选一次性计算，返回 final 分数数组
         """
-        content = chunk.get('content', '')
-        
-        fuzzy_score = fuzz.partial_ratio(query, content)
-        
-        query_keywords = self._extract_keywords(query)
-        content_keywords = self._extract_keywords(content)
-        
-        if query_keywords:
-            keyword_hits = len(query_keywords & content_keywords)
-            keyword_coverage = (keyword_hits / len(query_keywords)) * 100
-        else:
-            keyword_coverage = 0
-        
-        # Milvus 语义相似度
-        milvus_distance = chunk.get('semantic_score')
-        
-        if milvus_distance is None:
-            milvus_similarity = 80.0 
+        features = QueryFeatures(query)
+        contents = [chunk.get('content', '') or '' for chunk in chunks]
+        n = len(contents)
+
+        # 模糊匹配：一次批量调用 (C 实现，多线程)
+        fuzzy = rf_process.cdist([query], contents, scorer=fuzz.partial_ratio, dtype=np.float32, workers=-1)[0].astype(np.float64)
+
+        # 关键词覆盖率
+        if features.n_keywords:
+            hits = np.fromiter((features.keyword_hits(c) for c in contents), dtype=np.float64, count=n)
+            keyword_coverage = hits / features.n_keywords * 100
         else:
-            milvus_similarity = 100 / (1 + milvus_distance * 0.1)
-        
+            keyword_coverage = np.zeros(n)
+
+        # Milvus 语义相似度 (缺失时按 80 计)
+        distances = np.array([np.nan if c.get('semantic_score') is None else c['semantic_score'] for c in chunks], dtype=np.float64)
+        milvus_similarity = np.where(np.isnan(distances), 80.0, 100 / (1 + np.nan_to_num(distances) * 0.1))
+
         # 位置权重
-        position_bonus = 0
-        if 'milvus_rank' in chunk:
-            rank = chunk['milvus_rank']
-            position_bonus = max(0, 20 - rank)
-        
+        ranks = np.array([c.get('milvus_rank', 20) for c in chunks], dtype=np.float64)
+        position_bonus = np.maximum(0, 20 - ranks)
+
         # 长度惩罚
-        content_len = len(content)
-        if 200 <= content_len <= 600:
-            length_score = 100
-        elif content_len < 200:
-            length_score = 50 + (content_len / 200) * 50
-        else:
-            length_score = 100 - min(50, (content_len - 600) / 20)
-        
+        lengths = np.fromiter((len(c) for c in contents), dtype=np.float64, count=n)
+        length_score = np.where(
+            lengths < 200, 50 + lengths / 200 * 50,
+            np.where(lengths <= 600, 100.0, 100 - np.minimum(50, (lengths - 600) / 20))
+        )
+
         # 专有名词加分
-        # 1. 英文正则保持不变
-        en_pattern = r'\b[A-Z][a-z]+\b|[A-Z]{2,}'
-        
-        # 2. 简单的中文关键词提取（这里用双字以上匹配作为简易替代）
-        # 如果 query 只有中文，把所有长度>=2的词都视为潜在“关键实体”进行匹配
-        def extract_potential_nouns(text):
-            res = set(re.findall(en_pattern, text))
-            # 提取中文连续字符 (简单粗暴，仅供优化参考)
-            zh_words = [w for w in re.split(r'[^\u4e00-\u9fa5]', text) if len(w) >= 2]
-            res.update(zh_words)
-            return res
-
-        query_proper_nouns = extract_potential_nouns(query)
-        content_proper_nouns = extract_potential_nouns(content)        
-        proper_noun_bonus = 0
-        if query_proper_nouns:
-            hits = len(query_proper_nouns & content_proper_nouns)
-            if hits > 0:
-                proper_noun_bonus = 30
-        
+        if features.proper_nouns:
+            proper_noun_bonus = np.fromiter((30.0 if features.has_proper_noun(c) else 0.0 for c in contents), dtype=np.float64, count=n)
+        else:
+            proper_noun_bonus = np.zeros(n)
+
         base_score = (
-            fuzzy_score * 0.25 +
+            fuzzy * 0.25 +
             keyword_coverage * 0.25 +
             milvus_similarity * 0.35 +
             length_score * 0.15
         )
-        
         final_score = base_score + position_bonus + proper_noun_bonus
 
-        chunk['score_details'] = {
-            'final': final_score,
-            'fuzzy': fuzzy_score,
-            'kw': keyword_coverage,
-            'vec': milvus_similarity
-        }
-        
+        for i, chunk in enumerate(chunks):
+            chunk['score_details'] = {
+                'final': float(final_score[i]),
+                'fuzzy': float(fuzzy[i]),
+                'kw': float(keyword_coverage[i]),
+                'vec': float(milvus_similarity[i])
+            }
         return final_score
 
+    def _calculate_composite_score(self, query: str, chunk: Dict[str, Any]) -> float:
+        """单个候选打分 (兼容旧接口)"""
+        return float(self._score_batch(query, [chunk])[0])
+
     def process(self, query: str, chunks: List[Dict[str, Any]], fuzzy_threshold: int = 10) -> Tuple[List[Dict[str, Any]], str]:
         if not chunks:
             return [], "no_chunks"
-        
+
         for rank, chunk in enumerate(chunks, 1):
             chunk['milvus_rank'] = rank
-        
-        for chunk in chunks:
-            score = self._calculate_composite_score(query, chunk)
-            chunk['composite_score'] = score
-        
-        sorted_chunks = sorted(chunks, key=lambda c: c.get('composite_score', 0), reverse=True)
-        
-        return sorted_chunks, "success"
\ No newline at end of file
+
+        scores = self._score_batch(query, chunks)
+        for chunk, score in zip(chunks, scores):
+            chunk['composite_score'] = float(score)
+
+        # 稳定排序：同分时保持召回顺序
+        order = np.argsort(-scores, kind="stable")
+        sorted_chunks = [chunks[i] for i in order]
+
+        if self.cross_encoder is not None:
+            try:
+                return self._cross_encoder_rerank(query, sorted_chunks), "success"
+            except Exception as e:
+                logger.error(f"❌ Cross-Encoder 重排失败，使用启发式结果: {e}")
+
+        return sorted_chunks, "success"
+
+    def _cross_encoder_rerank(self, query: str, sorted_chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """前 rerank_top_n 个候选按 Cross-Encoder 概率重排 (composite_score 改为 概率*100)，其余保持启发式顺序排在后面"""
+        head, tail = sorted_chunks[:self.rerank_top_n], sorted_chunks[self.rerank_top_n:]
+        probs = self.cross_encoder.score(query, head)
+        for chunk, prob in zip(head, probs):
+            chunk['score_details']['ce'] = float(prob)
+            chunk['composite_score'] = float(prob) * 100
+        # 未精排的候选分数不高于精排结果的最低分，保证 composite_score 与最终顺序一致
+        floor = float(probs.min()) * 100 if len(probs) else 0.0
+        for chunk in tail:
+            chunk['composite_score'] = min(chunk['composite_score'], floor)
+        order = np.argsort(-probs, kind="stable")
+        return [head[i] for i in order] + tail
@@ -1,16 +1,185 @@
 import os
+import json
 import logging
 import random
 import re
+import time
+import threading
+import numpy as np
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from pymilvus import connections, Collection, FieldSchema, CollectionSchema, DataType, utility
 from utils.ernie_client import ERNIEClient
+from utils.lru_cache import LRUCache
+from utils.metrics import LatencyTracker
+from utils.bm25_index import BM25Index
+from utils.ingest_journal import IngestJournal, chunk_hash
+from utils.fusion import fuse, resolve_fusion_config
 
 # 配置日志
 logger = logging.getLogger("vector_store")
 logger.setLevel(logging.INFO)
 
+# 查询向量缓存：同一 Embedding 模型的所有集合共享一份
+QUERY_CACHE_SIZE = 2048
+QUERY_CACHE_TTL = 3600
+_query_caches = {}
+_query_caches_lock = threading.Lock()
+
+def get_query_cache(model_name):
+    with _query_caches_lock:
+        if model_name not in _query_caches:
+            _query_caches[model_name] = LRUCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+        return _query_caches[model_name]
+
+# 全量查询的分页大小 (单次 query 的 limit 上限为 16384，超出的行需要用 query_iterator 分页取回)
+QUERY_BATCH_SIZE = 4096
+
+# ANN 索引预设：构建参数 + 搜索参数。度量固定为 L2 (下游打分按 L2 距离换算)
+INDEX_PRESETS = {
+    "FLAT": {"params": {}, "search_params": {}},
+    "HNSW": {"params": {"M": 16, "efConstruction": 200}, "search_params": {"ef": 64}},
+    "IVF_FLAT": {"params": {"nlist": 1024}, "search_params": {"nprobe": 16}},
+    "IVF_SQ8": {"params": {"nlist": 1024}, "search_params": {"nprobe": 16}},
+}
+# 召回/延迟报告默认扫描的搜索参数
+INDEX_SEARCH_SWEEPS = {
+    "FLAT": [{}],
+    "HNSW": [{"ef": ef} for ef in (16, 32, 64, 128, 256)],
+    "IVF_FLAT": [{"nprobe": n} for n in (1, 4, 16, 64)],
+    "IVF_SQ8": [{"nprobe": n} for n in (1, 4, 16, 64)],
+}
+
+def resolve_index_config(index_config=None, uri=None, collection_name=None):
+    """
+    index_config 可以是预设名 (如 "HNSW") 或 dict(index_type, params, search_params)，未指定的参数取预设值。
+    优先级: 构造参数 > 环境变量 INDEX_CONFIG 中该集合的配置 > INDEX_CONFIG 中的 "*" > MILVUS_INDEX_TYPE > 默认
+    (Milvus Lite 使用 FLAT，Milvus 服务端使用 HNSW)。INDEX_CONFIG 为 JSON，键为 Milvus 集合名，例如
+    {"*": "HNSW", "kb_xxx": {"index_type": "IVF_FLAT", "params": {"nlist": 2048}}}
+    """
+    layers = []
+    env_value = os.getenv("INDEX_CONFIG")
+    if env_value:
+        try:
+            env_config = json.loads(env_value)
+            layers += [env_config.get("*"), env_config.get(collection_name)]
+        except ValueError as e:
+            logger.warning(f"⚠️ INDEX_CONFIG 解析失败，使用默认索引配置: {e}")
+    layers.append(index_config)
+
+    merged = {}
+    for layer in layers:
+        if not layer: continue
+        if isinstance(layer, str): layer = {"index_type": layer}
+        # 后一层换了索引类型时，前面层的参数属于其他类型，丢弃
+        if layer.get("index_type") and str(layer["index_type"]).upper() != str(merged.get("index_type", "")).upper():
+            merged = {}
+        merged.update({k: v for k, v in layer.items() if k not in ("params", "search_params")})
+        for key in ("params", "search_params"):
+            merged[key] = {**(merged.get(key) or {}), **(layer.get(key) or {})}
+    index_config = merged
+    default_type = os.getenv("MILVUS_INDEX_TYPE") or ("FLAT" if uri and uri.endswith(".db") else "HNSW")
+    index_type = str(index_config.get("index_type") or default_type).upper()
+    if index_type not in INDEX_PRESETS:
+        raise ValueError(f"不支持的索引类型: {index_type} (可选: {', '.join(INDEX_PRESETS)})")
+    preset = INDEX_PRESETS[index_type]
+    return {
+        "index_type": index_type,
+        "params": {**preset["params"], **(index_config.get("params") or {})},
+        "search_params": {**preset["search_params"], **(index_config.get("search_params") or {})},
+    }
+
+# 关键词检索使用本地 BM25 倒排索引，文件放在 Milvus Lite 的 .db 旁边 (远程 Milvus 时放在当前目录)
+_FILENAME_EXPR = re.compile(r"""^\s*filename\s*==\s*['"](.+)['"]\s*$""")
+
+def keyword_index_path(uri, collection_name):
+    base_dir = os.path.dirname(os.path.abspath(uri)) if uri and uri.endswith(".db") else "."
+    return os.path.join(base_dir, "bm25_index", f"{collection_name}.bm25.json")
+
+def remove_keyword_index(uri, collection_name):
+    path = keyword_index_path(uri, collection_name)
+    for suffix in ("", ".log"):
+        if os.path.exists(path + suffix): os.remove(path + suffix)
+
+# 入库断点日志与 BM25 索引放在同一目录
+def ingest_journal_path(uri, collection_name):
+    base_dir = os.path.dirname(os.path.abspath(uri)) if uri and uri.endswith(".db") else "."
+    return os.path.join(base_dir, "ingest_journal", f"{collection_name}.sqlite")
+
+def remove_ingest_journal(uri, collection_name):
+    path = ingest_journal_path(uri, collection_name)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix): os.remove(path + suffix)
+
+# 集合数据版本号：每次插入/删除后递增，供答案缓存等判断数据是否变化 (按集合名共享，同一集合的多个实例一致)
+_collection_versions = {}
+_collection_versions_lock = threading.Lock()
+
+def bump_collection_version(collection_name):
+    with _collection_versions_lock:
+        _collection_versions[collection_name] = _collection_versions.get(collection_name, 0) + 1
+        return _collection_versions[collection_name]
+
+def collection_version(collection_name):
+    with _collection_versions_lock:
+        return _collection_versions.get(collection_name, 0)
+
+# 混合检索的各路召回在共享的有界线程池中并行执行
+SEARCH_WORKERS = 8
+_search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search_leg")
+
+# 自适应候选深度：先只取 主键+分数，某一路在当前深度下分数仍然平坦 (尾部接近头部) 时才加深，最后只为融合结果回表取正文
+ADAPTIVE_INITIAL_FACTOR = 2   # 初始每路深度 = top_k * 2
+ADAPTIVE_MAX_FACTOR = 5       # 最大每路深度 = top_k * 5 (与非自适应模式相同)
+ADAPTIVE_FLAT_RATIO = 0.9     # 尾部分数 / 头部分数 >= 该值视为平坦
+
+# 片段正文缓存 (主键 -> 行)：自增主键不会复用，正文按主键缓存不会过期，只需在删除行时移除
+CHUNK_CACHE_SIZE = 4096
+
+def _timed_call(func, args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class SearchResults(list):
+    """search() 的返回值：普通列表，额外携带各路耗时与降级信息"""
+    def __init__(self, items=(), timings=None, degraded_legs=None):
+        super().__init__(items)
+        self.timings = timings or {}
+        self.degraded_legs = degraded_legs or []
+
+class Candidate:
+    """检索第一阶段的候选：只有主键、分数与定位信息，不含正文 (仅关键词命中时 page 为 None，回表后补齐)"""
+    __slots__ = ("id", "score", "filename", "page", "semantic_score", "raw_score", "type")
+
+    def __init__(self, doc_id, score, filename, page, semantic_score, raw_score, leg_type):
+        self.id = doc_id
+        self.score = score
+        self.filename = filename
+        self.page = page
+        self.semantic_score = semantic_score
+        self.raw_score = raw_score
+        self.type = leg_type
+
+    def to_dict(self, row):
+        """与回表得到的行合并为旧版 search() 的结果结构"""
+        return {
+            "content": row.get("content"),
+            "filename": row.get("filename"),
+            "page": row.get("page"),
+            "chunk_id": row.get("chunk_id"),
+            "semantic_score": self.semantic_score,
+            "raw_score": self.raw_score,
+            "type": self.type,
+            "id": self.id,
+            "fusion_score": self.score,
+        }
+
 class MilvusVectorStore:
-    def __init__(self, uri, token, collection_name, embedding_client=None, embedding_service_url=None, qianfan_api_key=None):
+    def __init__(self, uri, token, collection_name, embedding_client=None, embedding_service_url=None, qianfan_api_key=None,
+                 dense_timeout=15.0, keyword_timeout=5.0, index_config=None,
+                 write_buffer_rows=2000, write_buffer_seconds=30.0, fusion_config=None):
         self.collection_name = collection_name
         self.uri = uri
         self.token = token
@@ -24,10 +193,60 @@ class MilvusVectorStore:
                 embed_api_base=embedding_service_url,
                 embed_api_key=qianfan_api_key
             )
+
+        model_name = getattr(self.embedding_client, 'embedding_model_name', type(self.embedding_client).__name__)
+        self.query_cache = get_query_cache(model_name)
+
+        # 各路召回的超时 (秒) 与耗时统计
+        self.leg_timeouts = {"dense": dense_timeout, "keyword": keyword_timeout}
+        self.leg_latency = {leg: LatencyTracker(f"{leg}_leg") for leg in self.leg_timeouts}
+
+        # 检索开销统计：每次查询回表的正文行数 / 只含主键的行数，以及端到端延迟
+        self.retrieval_stats = {"queries": 0, "content_rows": 0, "id_rows": 0}
+        self.search_latency = LatencyTracker("search")
+        self.hydrate_latency = LatencyTracker("hydrate")
+        self.chunk_cache = LRUCache(maxsize=CHUNK_CACHE_SIZE)
+
+        # 多路融合方式与各路权重 (可按集合配置，见 resolve_fusion_config)
+        self.fusion_config = resolve_fusion_config(fusion_config, collection_name)
+
+        # ANN 索引配置 (新建集合时生效；已有集合以实际索引为准，可用 rebuild_index 切换)
+        self._requested_index_config = index_config
+        self.index_config = resolve_index_config(index_config, uri, collection_name)
+
+        # 写缓冲：buffered_writes() 范围内的插入先攒批，达到行数/时间阈值时批量写入，退出时 flush 一次
+        # _pending_docs 为待向量化的文档 (insert_documents)，_pending_rows 为已向量化的 (文档, 向量) (buffer_embedded_documents)
+        self.write_buffer_rows = max(1, int(write_buffer_rows))
+        self.write_buffer_seconds = float(write_buffer_seconds)
+        self._pending_docs = []
+        self._pending_rows = []
+        self._buffer_depth = 0
+        self._buffer_lock = threading.RLock()
+        self._last_write_time = time.time()
+        self.write_stats = {"rows": 0, "write_seconds": 0.0, "inserts": 0, "flushes": 0}
+        # 入库去重统计：复用已有向量的片段数
+        self.dedup_stats = {"chunks_reused": 0}
             
         self._connect_milvus()
         self._init_collection()
 
+        # BM25 倒排索引：已有集合但索引文件不存在时，首次使用前从 Milvus 重建
+        index_path = keyword_index_path(uri, collection_name)
+        self.keyword_index = BM25Index(index_path)
+        self._keyword_index_lock = threading.Lock()
+        try:
+            self._keyword_index_ready = self.keyword_index.persisted or self.collection.num_entities == 0
+        except Exception:
+            self._keyword_index_ready = False
+
+        # 入库断点日志：记录每个文件各页的 OCR / 向量化 / 写入进度
+        self.ingest_journal = IngestJournal(ingest_journal_path(uri, collection_name))
+
+    @property
+    def data_version(self):
+        """当前集合的数据版本号 (插入/删除后递增)"""
+        return collection_version(self.collection_name)
+
     def _connect_milvus(self):
         try:
             if connections.has_connection("default"):
@@ -62,19 +281,70 @@ class MilvusVectorStore:
 
         if not utility.has_collection(self.collection_name):
             self.collection = Collection(self.collection_name, schema)
-            index_params = {
-                "metric_type": "L2", 
-                "index_type": "FLAT", 
-                "params": {} 
-            }
-            self.collection.create_index(field_name="embedding", index_params=index_params)
-            logger.info(f"✨ 创建新集合 (FLAT 索引): {self.collection_name}")
+            self.collection.create_index(field_name="embedding", index_params=self._build_index_params(self.index_config))
+            logger.info(f"✨ 创建新集合 ({self.index_config['index_type']} 索引): {self.collection_name}")
         else:
             self.collection = Collection(self.collection_name)
-            logger.info(f"📚 加载已有集合: {self.collection_name}")
+            self._load_existing_index_config()
+            logger.info(f"📚 加载已有集合: {self.collection_name} ({self.index_config['index_type']} 索引)")
         
         self.collection.load()
 
+    @staticmethod
+    def _build_index_params(config):
+        return {"metric_type": "L2", "index_type": config["index_type"], "params": dict(config["params"])}
+
+    def _load_existing_index_config(self):
+        """读取已有集合的实际索引类型；与请求的类型不同时沿用实际索引 (搜索参数取预设)"""
+        try:
+            if not self.collection.indexes: return
+            info = dict(self.collection.indexes[0].params)
+            index_type = str(info.get("index_type", "")).upper()
+            if index_type not in INDEX_PRESETS or index_type == self.index_config["index_type"]: return
+            build_params = info.get("params") or {k: v for k, v in info.items() if k not in ("index_type", "metric_type")}
+            logger.warning(f"⚠️ 集合 {self.collection_name} 的实际索引为 {index_type}，与配置的 {self.index_config['index_type']} 不同，"
+                           f"沿用实际索引 (可在「效果诊断」中按配置重建)")
+            self.index_config = resolve_index_config({"index_type": index_type, "params": build_params}, self.uri)
+        except Exception as e:
+            logger.warning(f"⚠️ 读取索引信息失败，使用默认配置: {e}")
+
+    def search_params(self, limit=None):
+        """当前索引对应的 search 参数；HNSW 要求 ef 不小于返回条数"""
+        params = dict(self.index_config["search_params"])
+        if self.index_config["index_type"] == "HNSW" and limit:
+            params["ef"] = max(int(params.get("ef", 64)), int(limit))
+        return {"metric_type": "L2", "params": params}
+
+    def configured_index_config(self):
+        """按构造参数与 INDEX_CONFIG 解析出的该集合的目标索引配置 (不受实际索引影响)"""
+        return resolve_index_config(self._requested_index_config, self.uri, self.collection_name)
+
+    def rebuild_index(self, index_config):
+        """
+        在线切换索引：release -> drop_index -> create_index -> load。
+        重建期间向量检索会失败并被 search() 标记为降级，关键词检索照常服务
+        """
+        new_config = resolve_index_config(index_config, self.uri, self.collection_name)
+        old_config = self.index_config
+        start = time.time()
+        self.collection.release()
+        try:
+            self.collection.drop_index()
+            self.collection.create_index(field_name="embedding", index_params=self._build_index_params(new_config))
+            self.index_config = new_config
+        except Exception as e:
+            logger.error(f"❌ 索引重建失败，恢复原索引: {e}")
+            try:
+                if not self.collection.has_index():
+                    self.collection.create_index(field_name="embedding", index_params=self._build_index_params(old_config))
+            finally:
+                self.collection.load()
+            raise
+        self.collection.load()
+        elapsed = time.time() - start
+        logger.info(f"🔧 索引已重建: {old_config['index_type']} -> {new_config['index_type']} ({elapsed:.1f}s)")
+        return f"✅ 索引已重建为 {new_config['index_type']} {new_config['params']} ({elapsed:.1f}s)"
+
     def get_embeddings(self, texts):
         if not texts: return []
         try:
@@ -86,142 +356,264 @@ class MilvusVectorStore:
             logger.error(f"Embedding error: {e}")
             return []
 
-    def _keyword_search(self, query, top_k=50, expr=None):
-        results = []
-        try:
-            stop_words = {
-                "的", "了", "和", "是", "就", "都", "而", "及", "与", "着", "或", 
-                "一个", "没有", "我们", "你们", "他们", "它", "解释", "是什么", 
-                "含义", "文章", "图片", "这个", "篇", "请问", "以及", "什么", 
-                "如何", "怎么", "为什么", "分析", "介绍", "描述",
-                "what", "is", "the", "of", "in", "and", "to", "a", "an", "are",
-                "explain", "describe", "tell", "me", "about", "how", "why", "paper", "article"
-            }
-            
-            keywords = []
-            try:
-                import jieba
-                words = jieba.cut_for_search(query) 
-                for w in words:
-                    w = w.strip()
-                    if len(w) > 1 and w.lower() not in stop_words:
-                        keywords.append(w)
-            except ImportError:
-                clean_query = re.sub(r"[^\u4e00-\u9fa5a-zA-Z0-9]", " ", query)
-                keywords = [w for w in clean_query.split() if w.lower() not in stop_words and len(w) > 1]
-
-            if not keywords: return []
-            keywords = list(set(keywords))
-
-            zh_keywords = []
-            en_keywords = []
-            
-            for k in keywords:
-                if any('\u4e00' <= char <= '\u9fff' for char in k):
-                    zh_keywords.append(k)
-                else:
-                    en_keywords.append(k)
-            
-            final_parts = []
-            for k in zh_keywords[:5]:
-                final_parts.append(f'content like "%{k}%"')
-            for k in en_keywords[:5]:
-                final_parts.append(f'content like "%{k}%"')
-            
-            if not final_parts: return []
+    def get_query_embedding(self, query):
+        """查询向量：LRU+TTL 缓存，并发的相同查询只请求一次"""
+        if not query: return None
+        key = " ".join(query.split())
+        return self.query_cache.get_or_compute(key, lambda: self.embedding_client.get_embedding(query))
 
-            keyword_expr = " || ".join(final_parts) 
-            
-            if expr:
-                final_milvus_expr = f"({expr}) and ({keyword_expr})"
-            else:
-                final_milvus_expr = keyword_expr
-            
-            res = self.collection.query(
-                expr=final_milvus_expr,
-                output_fields=["id", "filename", "page", "content", "chunk_id"],
-                limit=top_k
+    def _ensure_keyword_index(self):
+        if self._keyword_index_ready: return
+        with self._keyword_index_lock:
+            if self._keyword_index_ready: return
+            self.rebuild_keyword_index()
+            self._keyword_index_ready = True
+
+    def rebuild_keyword_index(self, batch_size=1000):
+        """从 Milvus 全量读取 content 重建 BM25 索引"""
+        start = time.time()
+        self.keyword_index.clear()
+        iterator = self.collection.query_iterator(
+            batch_size=batch_size, expr="id > 0", output_fields=["id", "filename", "content"]
+        )
+        while True:
+            rows = iterator.next()
+            if not rows:
+                iterator.close()
+                break
+            self.keyword_index.add_many(
+                [r["id"] for r in rows], [r["content"] for r in rows], [r["filename"] for r in rows]
             )
-            
-            for hit in res:
-                results.append({
-                    "content": hit.get("content"),
-                    "filename": hit.get("filename"),
-                    "page": hit.get("page"),
-                    "chunk_id": hit.get("chunk_id"),
-                    "semantic_score": 0.0,  
-                    "raw_score": 100.0,     
-                    "type": "keyword",
-                    "id": hit.get("id")
-                })
-        except Exception as e:
-            print(f"⚠️ 关键词检索跳过: {e}")
-            
-        return results
+        self.keyword_index.save()
+        logger.info(f"🔁 重建 BM25 索引: {len(self.keyword_index)} 条, 耗时 {time.time() - start:.1f}s")
 
-    def search(self, query: str, top_k: int = 10, **kwargs):
+    def _dense_ids(self, query, top_k=50, expr=None):
+        """向量检索第一阶段：只返回 [(主键, raw_score, 距离, 文件名, 页码)]，不取正文"""
+        query_vector = self.get_query_embedding(query)
+        if not query_vector: return []
+        milvus_res = self.collection.search(
+            data=[query_vector],
+            anns_field="embedding",
+            param=self.search_params(limit=top_k),
+            limit=top_k,
+            expr=expr,
+            output_fields=["filename", "page"]
+        )
+        return [(hit.id, 1.0 / (1.0 + hit.distance) * 100, hit.distance, hit.entity.get("filename"), hit.entity.get("page"))
+                for hit in milvus_res[0]]
+
+    def _keyword_ids(self, query, top_k=50, expr=None):
+        """关键词检索第一阶段：BM25 排名 [(主键, 分数)]，非文件名条件只回表取主键过滤"""
+        self._ensure_keyword_index()
+        match = _FILENAME_EXPR.match(expr) if expr else None
+        filenames = {match.group(1)} if match else None
+        residual_expr = expr if (expr and not match) else None
+        ranked = self.keyword_index.search(query, top_k=top_k * 4 if residual_expr else top_k, filenames=filenames)
+        if not ranked or not residual_expr: return ranked
+        res = self.collection.query(
+            expr=f"({residual_expr}) and id in [{','.join(str(doc_id) for doc_id, _ in ranked)}]",
+            output_fields=["id"], limit=len(ranked)
+        )
+        self.retrieval_stats["id_rows"] += len(res)
+        allowed = {r["id"] for r in res}
+        return [(doc_id, score) for doc_id, score in ranked if doc_id in allowed][:top_k]
+
+    def _fetch_rows(self, ids):
+        """按主键批量回表取正文"""
+        if not ids: return {}
+        res = self.collection.query(
+            expr=f"id in [{','.join(str(i) for i in ids)}]",
+            output_fields=["id", "filename", "page", "content", "chunk_id"],
+            limit=len(ids)
+        )
+        self.retrieval_stats["content_rows"] += len(res)
+        return {r["id"]: r for r in res}
+
+    @staticmethod
+    def _is_flat(scores, depth):
+        """该路返回满 depth 条且尾部分数接近头部分数时，说明更深处可能还有同样相关的候选"""
+        if len(scores) < depth or not scores or scores[0] <= 0: return False
+        return scores[-1] / scores[0] >= ADAPTIVE_FLAT_RATIO
+
+    def search_candidates(self, query: str, top_k: int = 10, **kwargs):
+        """
+        两阶段检索的第一阶段：各路只取 主键 + 分数 (向量路顺带文件名/页码)，融合后返回前 top_k*2 个 Candidate，不取正文。
+        adaptive=True 时从 top_k*2 起步，只加深分数仍平坦的那一路；否则每路固定取 top_k*5
+        """
+        start = time.perf_counter()
         expr = kwargs.get('expr', None)
+        # 向量检索可单独指定查询文本 (例如未经翻译扩展的原问题)，关键词检索始终使用 query
+        dense_query = kwargs.get('dense_query') or query
+        adaptive = kwargs.get('adaptive')
+
+        depth = top_k * (ADAPTIVE_INITIAL_FACTOR if adaptive else ADAPTIVE_MAX_FACTOR)
+        max_depth = top_k * ADAPTIVE_MAX_FACTOR
+        legs = {
+            "dense": (self._dense_ids, (dense_query, depth, expr)),
+            "keyword": (self._keyword_ids, (query, depth, expr)),
+        }
+        leg_results, timings, degraded = self._run_legs(legs)
+        depths = {name: depth for name in legs}
+
+        # 每次深度翻倍，直到不再平坦或达到上限
+        while adaptive:
+            widen = {}
+            for name, (func, args) in legs.items():
+                scores = [r[1] for r in leg_results[name]]
+                if depths[name] < max_depth and self._is_flat(scores, depths[name]):
+                    depths[name] = min(max_depth, depths[name] * 2)
+                    widen[name] = (func, (args[0], depths[name], expr))
+            if not widen: break
+            more, more_timings, more_degraded = self._run_legs(widen)
+            degraded.extend(n for n in more_degraded if n not in degraded)
+            for name in widen:
+                if name not in more_degraded: leg_results[name] = more[name]
+                timings[name] = round(timings[name] + more_timings[name], 4)
+
+        dense_hits, keyword_hits = leg_results["dense"], leg_results["keyword"]
+        self.retrieval_stats["id_rows"] += len(dense_hits) + len(keyword_hits)
+        config = self.fusion_config
+        fused_ids, fused_scores = fuse({
+            "dense": (np.array([h[0] for h in dense_hits], dtype=np.int64), np.array([h[1] for h in dense_hits], dtype=np.float64)),
+            "keyword": (np.array([h[0] for h in keyword_hits], dtype=np.int64), np.array([h[1] for h in keyword_hits], dtype=np.float64)),
+        }, method=config["method"], weights=config["weights"], k=config.get("k", 60), top_k=top_k * 2)
+
+        dense_by_id = {h[0]: h for h in dense_hits}
+        keyword_by_id = dict(keyword_hits)
+        doc_file = self.keyword_index.doc_file
+        candidates = []
+        for doc_id, score in zip(fused_ids.tolist(), fused_scores.tolist()):
+            dense_hit = dense_by_id.get(doc_id)
+            if dense_hit:
+                candidates.append(Candidate(doc_id, score, dense_hit[3], dense_hit[4], dense_hit[2], dense_hit[1], "dense"))
+            else:
+                # 仅关键词命中的候选：文件名取自 BM25 索引，页码在回表时补齐
+                candidates.append(Candidate(doc_id, score, doc_file.get(doc_id), None, 0.0, keyword_by_id[doc_id], "keyword"))
+
+        elapsed = time.perf_counter() - start
+        self.search_latency.add(elapsed)
+        self.retrieval_stats["queries"] += 1
+        cache_stats = self.query_cache.stats()
+        print(f"🔍 混合检索: 深度 {depths} | 向量{len(dense_hits)} + 关键词{len(keyword_hits)} -> 融合{len(candidates)} "
+              f"(查询向量缓存命中率 {cache_stats['hit_rate']*100:.0f}%)")
+        print(f"⏱️ 各路耗时: " + ", ".join(f"{k}={v*1000:.0f}ms" for k, v in timings.items()) + (f" | 降级: {degraded}" if degraded else ""))
+        return SearchResults(candidates, timings=timings, degraded_legs=degraded)
 
-        # === 1. 向量检索 (Dense) ===
-        dense_results = []
+    def hydrate(self, candidates, limit=None):
+        """
+        两阶段检索的第二阶段：只为前 limit 个候选 (默认全部) 取正文。
+        先查片段正文缓存，未命中的按主键批量回表；返回与 search() 相同结构的 dict 列表，顺序与候选一致
+        """
+        start = time.perf_counter()
+        selected = list(candidates[:limit] if limit else candidates)
+        rows, missing = {}, []
+        for candidate in selected:
+            row = self.chunk_cache.get(candidate.id)
+            if row is None:
+                missing.append(candidate.id)
+            else:
+                rows[candidate.id] = row
+        for doc_id, row in self._fetch_rows(missing).items():
+            self.chunk_cache.set(doc_id, row)
+            rows[doc_id] = row
+        # 回表时已被删除的候选直接跳过
+        results = [c.to_dict(rows[c.id]) for c in selected if c.id in rows]
+
+        elapsed = time.perf_counter() - start
+        self.hydrate_latency.add(elapsed)
+        timings = {**getattr(candidates, "timings", {}), "hydrate": round(elapsed, 4)}
+        metrics = self.retrieval_metrics()
+        print(f"💧 取正文: {len(selected)}/{len(candidates)} 个候选 (缓存命中 {len(selected) - len(missing)}, 回表 {len(missing)}) "
+              f"{elapsed*1000:.0f}ms")
+        print(f"📦 平均每次查询回表 {metrics['avg_content_rows']} 行正文 / {metrics['avg_id_rows']} 行主键 | "
+              f"检索延迟 p50 {metrics['latency']['p50']*1000:.0f}ms / p95 {metrics['latency']['p95']*1000:.0f}ms")
+        return SearchResults(results, timings=timings, degraded_legs=getattr(candidates, "degraded_legs", []))
+
+    def retrieval_metrics(self) -> dict:
+        """平均每次查询回表行数、检索 (第一阶段) 与取正文延迟 p50/p95、片段正文缓存命中率"""
+        stats = self.retrieval_stats
+        queries = max(1, stats["queries"])
+        return {
+            "queries": stats["queries"],
+            "avg_content_rows": round(stats["content_rows"] / queries, 1),
+            "avg_id_rows": round(stats["id_rows"] / queries, 1),
+            "latency": self.search_latency.summary(),
+            "hydrate_latency": self.hydrate_latency.summary(),
+            "chunk_cache": self.chunk_cache.stats(),
+        }
+
+    def _run_legs(self, legs):
+        """
+        并行执行各路召回，每路有独立超时。
+        返回 ({leg: results}, {leg: 耗时秒}, [降级的 leg])，超时或异常的 leg 结果为空列表
+        """
+        start = time.perf_counter()
+        futures = {}
+        for name, (func, args) in legs.items():
+            futures[name] = _search_executor.submit(_timed_call, func, args)
+
+        results, timings, degraded = {}, {}, []
+        for name, future in futures.items():
+            remaining = max(0.0, start + self.leg_timeouts.get(name, 10.0) - time.perf_counter())
+            try:
+                results[name], elapsed = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                print(f"⚠️ {name} 检索超时 ({self.leg_timeouts.get(name)}s)，降级跳过")
+                results[name] = []
+                degraded.append(name)
+                elapsed = time.perf_counter() - start
+            except Exception as e:
+                print(f"❌ {name} 检索异常: {e}")
+                results[name] = []
+                degraded.append(name)
+                elapsed = time.perf_counter() - start
+            timings[name] = round(elapsed, 4)
+            self.leg_latency[name].add(elapsed)
+        return results, timings, degraded
+
+    def search(self, query: str, top_k: int = 10, **kwargs):
+        """
+        混合检索 (一次完成两个阶段)：search_candidates 取主键与分数并融合，再为全部融合结果取正文。
+        只需为部分候选取正文时，分别调用 search_candidates() 与 hydrate(candidates, limit)
+        """
+        return self.hydrate(self.search_candidates(query, top_k, **kwargs))
+
+    def _reusable_vectors(self, documents):
+        """按 text_hash 查找库中正文相同的片段，返回 {text_hash: 向量}"""
+        hashes = [doc.get('text_hash') for doc in documents]
+        pk_by_hash = self.ingest_journal.lookup_chunks(hashes)
+        if not pk_by_hash: return {}
         try:
-            query_vector = self.embedding_client.get_embedding(query)
-            if query_vector:
-                search_params = {"metric_type": "L2", "params": {}} 
-                
-                milvus_res = self.collection.search(
-                    data=[query_vector],
-                    anns_field="embedding", 
-                    param=search_params,
-                    limit=top_k * 5,
-                    expr=expr, 
-                    output_fields=["filename", "page", "content", "chunk_id"]
-                )
-                
-                for hit in milvus_res[0]:
-                    raw_score = 1.0 / (1.0 + hit.distance) * 100
-                    dense_results.append({
-                        "content": hit.entity.get("content"),
-                        "filename": hit.entity.get("filename"),
-                        "page": hit.entity.get("page"),
-                        "chunk_id": hit.entity.get("chunk_id"),
-                        "semantic_score": hit.distance, 
-                        "raw_score": raw_score,
-                        "type": "dense",
-                        "id": hit.id
-                    })
+            rows = self.collection.query(expr=f"id in {list(pk_by_hash.values())}", output_fields=["id", "embedding"])
         except Exception as e:
-            print(f"❌ 向量检索异常: {e}")
-
-        # === 2. 关键词检索 (Keyword) ===
-        keyword_results = self._keyword_search(query, top_k=top_k * 5, expr=expr)
+            logger.warning(f"⚠️ 读取可复用向量失败: {e}")
+            return {}
+        vec_by_pk = {r["id"]: list(r["embedding"]) for r in rows}
+        # 主键已不存在 (行被删除) 的哈希不复用
+        return {h: vec_by_pk[pk] for h, pk in pk_by_hash.items() if pk in vec_by_pk}
 
-        # === 3. RRF 融合 ===
-        rank_dict = {}
-        
-        def apply_rrf(results_list, k=60, weight=1.0):
-            for rank, item in enumerate(results_list):
-                doc_id = item.get('id') or item.get('chunk_id')
-                if doc_id not in rank_dict:
-                    rank_dict[doc_id] = {"data": item, "score": 0.0}
-                rank_dict[doc_id]["score"] += weight * (1.0 / (k + rank))
-
-        apply_rrf(dense_results, weight=4.0)
-        apply_rrf(keyword_results, weight=1.0) 
-
-        # === 4. 排序输出 ===
-        sorted_docs = sorted(rank_dict.values(), key=lambda x: x['score'], reverse=True)
-        final_results = [item['data'] for item in sorted_docs[:top_k * 2]]
-        
-        print(f"🔍 混合检索: 向量{len(dense_results)} + 关键词{len(keyword_results)} -> 融合{len(final_results)}")
-        return final_results
+    def embed_documents(self, documents):
+        """
+        为文档批量请求向量，返回 (有效文档, 向量)
+        带 text_hash 的文档先按正文哈希去重：库中已有的直接复用向量，同批内重复的只请求一次
+        """
+        reused = self._reusable_vectors(documents)
+        embeddings = [reused.get(doc.get('text_hash')) for doc in documents]
+        pending = {}  # 待请求文本 -> 对应的文档下标
+        for i, doc in enumerate(documents):
+            if embeddings[i] is not None: continue
+            pending.setdefault(doc.get('text_hash') or f"#{i}", []).append(i)
 
-    def insert_documents(self, documents):
-        if not documents: return
-        print(f"⚡ 正在请求 Embedding (共 {len(documents)} 条)...")
-        texts = [doc['content'] for doc in documents]
-        
-        embeddings = self.get_embeddings(texts)
+        saved = len(documents) - len(pending)
+        self.dedup_stats["chunks_reused"] += saved
+        if pending:
+            print(f"⚡ 正在请求 Embedding (共 {len(pending)} 条" + (f", 去重复用 {saved} 条)..." if saved else ")..."))
+            groups = list(pending.values())
+            vectors = self.get_embeddings([documents[idx[0]]['content'] for idx in groups])
+            for idx, emb in zip(groups, vectors):
+                for i in idx: embeddings[i] = emb
+        elif documents:
+            print(f"♻️ {len(documents)} 条片段全部复用已有向量，无需请求 Embedding")
 
         valid_docs, valid_vectors = [], []
         failed_count = 0
@@ -238,8 +630,14 @@ class MilvusVectorStore:
             
         if not valid_docs: 
             print("❌ 严重错误: 所有片段 Embedding 均失败，数据未入库！")
-            return
+        return valid_docs, valid_vectors
 
+    def insert_embedded_documents(self, valid_docs, valid_vectors):
+        """
+        列式批量写入 Milvus 并同步 BM25 索引 (不 flush)，返回写入的主键列表，失败时返回空列表。
+        写入成功的文档会带上 doc["pk"]，供缓冲写入的调用方确认哪些行已落库
+        """
+        if not valid_docs: return []
         try:
             data = [
                 [doc['filename'] for doc in valid_docs],
@@ -248,17 +646,228 @@ class MilvusVectorStore:
                 [doc['content'] for doc in valid_docs],
                 valid_vectors
             ]
-            self.collection.insert(data)
-            self.collection.flush()
+            self._ensure_keyword_index()
+            start = time.perf_counter()
+            insert_res = self.collection.insert(data)
+            self.write_stats["write_seconds"] += time.perf_counter() - start
+            self.write_stats["rows"] += len(valid_docs)
+            self.write_stats["inserts"] += 1
+            self.keyword_index.add_many(insert_res.primary_keys, data[3], data[0])
+            bump_collection_version(self.collection_name)
+            self.ingest_journal.record_chunk_pks(
+                [(doc.get('text_hash'), pk, doc['filename']) for doc, pk in zip(valid_docs, insert_res.primary_keys)]
+            )
+            for doc, pk in zip(valid_docs, insert_res.primary_keys):
+                doc['pk'] = pk
             logger.info(f"✅ 成功入库: 已插入 {len(valid_vectors)} 条数据")
+            return list(insert_res.primary_keys)
         except Exception as e:
             print(f"❌ Milvus 写入异常: {e}")
+            return []
+
+    def _write_pending(self):
+        with self._buffer_lock:
+            docs, self._pending_docs = self._pending_docs, []
+            rows, self._pending_rows = self._pending_rows, []
+            self._last_write_time = time.time()
+        if docs:
+            self.insert_embedded_documents(*self.embed_documents(docs))
+        for start in range(0, len(rows), self.write_buffer_rows):
+            batch = rows[start:start + self.write_buffer_rows]
+            self.insert_embedded_documents([doc for doc, _ in batch], [vec for _, vec in batch])
+
+    def _buffer_full_locked(self):
+        return (len(self._pending_docs) + len(self._pending_rows) >= self.write_buffer_rows or
+                time.time() - self._last_write_time >= self.write_buffer_seconds)
+
+    def flush(self):
+        """持久化边界：写出缓冲区中的行，并 flush Milvus 与 BM25 索引"""
+        self._write_pending()
+        start = time.perf_counter()
+        self.collection.flush()
+        self.write_stats["write_seconds"] += time.perf_counter() - start
+        self.write_stats["flushes"] += 1
+        self.keyword_index.save()
+        stats = self.write_stats
+        if stats["write_seconds"] > 0:
+            logger.info(f"💾 flush 完成: 累计 {stats['rows']} 行 / {stats['inserts']} 次 insert / {stats['flushes']} 次 flush, 写入吞吐 {stats['rows'] / stats['write_seconds']:.0f} 行/秒")
+
+    @contextmanager
+    def buffered_writes(self):
+        """
+        写缓冲上下文：范围内的 insert_documents 只进入缓冲区，退出时统一 flush 一次。可嵌套，最外层退出时 flush
+        """
+        with self._buffer_lock:
+            self._buffer_depth += 1
+        try:
+            yield self
+        finally:
+            with self._buffer_lock:
+                self._buffer_depth -= 1
+                outermost = self._buffer_depth == 0
+            if outermost:
+                self.flush()
+
+    def insert_documents(self, documents):
+        if not documents: return
+        with self._buffer_lock:
+            if self._buffer_depth > 0:
+                self._pending_docs.extend(documents)
+                if not self._buffer_full_locked(): return
+        if self._buffer_depth > 0:
+            self._write_pending()
+            return
+
+        # 非缓冲模式：立即写入并 flush
+        self.insert_embedded_documents(*self.embed_documents(documents))
+        self.flush()
+
+    def buffer_embedded_documents(self, valid_docs, valid_vectors):
+        """
+        写入已向量化的文档：buffered_writes() 范围内先进入缓冲区，达到阈值时批量写入；否则立即写入 (不 flush)。
+        是否已写入以 doc["pk"] 为准 (每次调用或 flush() 之后检查)
+        """
+        if not valid_docs: return
+        with self._buffer_lock:
+            if self._buffer_depth > 0:
+                self._pending_rows.extend(zip(valid_docs, valid_vectors))
+                if not self._buffer_full_locked(): return
+        if self._buffer_depth > 0:
+            self._write_pending()
+            return
+        self.insert_embedded_documents(valid_docs, valid_vectors)
+
+    def query_all(self, expr, output_fields, batch_size=QUERY_BATCH_SIZE):
+        """用 query_iterator 分页取回所有匹配的行，不受单次 query 的 limit 限制"""
+        iterator = self.collection.query_iterator(batch_size=batch_size, expr=expr, output_fields=output_fields)
+        rows = []
+        try:
+            while True:
+                batch = iterator.next()
+                if not batch: break
+                rows.extend(batch)
+        finally:
+            iterator.close()
+        return rows
+
+    def delete_rows(self, expr):
+        """按条件删除行并同步 BM25 索引，返回删除行数"""
+        ids = [r["id"] for r in self.query_all(expr, ["id"])]
+        if not ids: return 0
+        for start in range(0, len(ids), QUERY_BATCH_SIZE):
+            self.collection.delete(expr=f"id in {ids[start:start + QUERY_BATCH_SIZE]}")
+        self.collection.flush()
+        self.keyword_index.remove_ids(ids)
+        self.keyword_index.save()
+        self.ingest_journal.remove_chunk_pks(ids)
+        for doc_id in ids: self.chunk_cache.pop(doc_id)
+        bump_collection_version(self.collection_name)
+        return len(ids)
+
+    def clone_document(self, src_filename, dst_filename):
+        """把已入库文档的行复制为另一个文件名 (文件级去重)，复用向量，不调用 OCR / Embedding。返回复制的行数"""
+        rows = self.query_all(f'filename == "{src_filename}"', ["page", "chunk_id", "content", "embedding"])
+        if not rows: return 0
+        old_header, new_header = f"文档: {src_filename} (", f"文档: {dst_filename} ("
+        docs = [{
+            "filename": dst_filename,
+            "page": r["page"],
+            "chunk_id": r["chunk_id"],
+            "content": r["content"].replace(old_header, new_header, 1),
+        } for r in rows]
+        vectors = [list(r["embedding"]) for r in rows]
+        inserted = []
+        for start in range(0, len(docs), self.write_buffer_rows):
+            end = start + self.write_buffer_rows
+            inserted += self.insert_embedded_documents(docs[start:end], vectors[start:end])
+        if len(inserted) < len(docs):
+            # 部分批次写入失败：撤销已写入的行，由调用方按新文件重新处理
+            if inserted: self.delete_rows(f"id in {inserted}")
+            return 0
+        self.flush()
+        return len(inserted)
+
+    def apply_document_update(self, filename, new_docs):
+        """
+        文档更新：按正文哈希对比新旧片段，只改动变化的行
+        - 正文与页码都相同：保留原行
+        - 正文相同但页码变化：复用原向量与 chunk_id 重写该行，不请求 Embedding
+        - 新片段：向量化后写入，分配新的 chunk_id
+        - 不再出现的旧片段：删除
+        new_docs 不含 chunk_id，本方法就地填入。返回统计信息
+        """
+        old_rows = self.query_all(f'filename == "{filename}"', ["id", "page", "chunk_id", "content"])
+        old_by_hash = {}
+        for r in old_rows:
+            content = r["content"]
+            body = content.split("\n", 1)[1] if content.startswith("文档: ") and "\n" in content else content
+            old_by_hash.setdefault(chunk_hash(body), []).append(r)
+
+        next_chunk_id = max((r["chunk_id"] for r in old_rows), default=-1) + 1
+        kept, moved, added = 0, [], []
+        for doc in new_docs:
+            candidates = old_by_hash.get(doc["text_hash"])
+            if not candidates:
+                doc["chunk_id"] = next_chunk_id
+                next_chunk_id += 1
+                added.append(doc)
+                continue
+            # 同一正文出现多次时优先匹配同一页的旧行
+            match = next((r for r in candidates if r["page"] == doc["page"]), candidates[0])
+            candidates.remove(match)
+            doc["chunk_id"] = match["chunk_id"]
+            if match["page"] == doc["page"] and match["content"] == doc["content"]:
+                kept += 1
+            else:
+                moved.append((doc, match["id"]))
+        removed_ids = [r["id"] for rows in old_by_hash.values() for r in rows]
+
+        # 页码变化的行：取回原向量重写
+        moved_docs, moved_vectors = [], []
+        if moved:
+            rows = self.query_all(f"id in {[pk for _, pk in moved]}", ["id", "embedding"])
+            vec_by_pk = {r["id"]: list(r["embedding"]) for r in rows}
+            for doc, pk in moved:
+                if pk in vec_by_pk:
+                    moved_docs.append(doc)
+                    moved_vectors.append(vec_by_pk[pk])
+                else:
+                    added.append(doc)
+        self.insert_embedded_documents(moved_docs, moved_vectors)
+        # 写入成功的行带有 pk；重写失败的保留旧行 (页码暂时是旧的)，其页记为失败
+        rewritten = {id(doc) for doc in moved_docs if doc.get("pk") is not None}
+
+        reused_before = self.dedup_stats["chunks_reused"]
+        valid_docs, vectors = self.embed_documents(added) if added else ([], [])
+        inserted = set(map(id, valid_docs)) if self.insert_embedded_documents(valid_docs, vectors) else set()
+        failed_pages = sorted({doc["page"] for doc in added if id(doc) not in inserted} |
+                              {doc["page"] for doc in moved_docs if id(doc) not in rewritten})
+
+        # 先写入再删除旧行，中途失败时最多多出重复行而不会丢失内容
+        stale_ids = removed_ids + [pk for doc, pk in moved if id(doc) in rewritten]
+        if stale_ids:
+            self.delete_rows(f"id in {stale_ids}")
+        self.flush()
+        stats = {
+            "kept": kept,
+            "moved": len(rewritten),
+            "added": len(inserted),
+            "removed": len(removed_ids),
+            "embedded": len(added) - (self.dedup_stats["chunks_reused"] - reused_before),
+            "failed_pages": failed_pages,
+        }
+        logger.info(f"♻️ 文档更新 {filename}: {stats}")
+        return stats
 
     def delete_document(self, filename):
         if not filename: return "❌ 文件名为空"
         try:
             self.collection.delete(expr=f'filename == "{filename}"')
             self.collection.flush()
+            self.keyword_index.remove_filename(filename)
+            self.keyword_index.save()
+            self.ingest_journal.remove_file(filename)
+            bump_collection_version(self.collection_name)
             logger.info(f"🗑️ 已从库中删除文档: {filename}")
             return f"✅ 已成功删除: {filename}"
         except Exception as e:
@@ -268,7 +877,7 @@ class MilvusVectorStore:
 
     def list_documents(self):
         try:
-            res = self.collection.query(expr="id > 0", output_fields=["filename"], limit=16384)
+            res = self.query_all("id > 0", ["filename"])
             return sorted(list(set([r['filename'] for r in res])))
         except: return []
 
@@ -279,38 +888,84 @@ class MilvusVectorStore:
             return "\n\n".join([r['content'] for r in res])
         except: return ""
 
+    def _sample_recall_queries(self, sample_size=20):
+        """随机抽取库内片段并取其向量，作为自召回测试的查询"""
+        total = self.collection.num_entities
+        if total == 0: return []
+        limit = min(100, total)
+        res = self.collection.query(expr="id > 0", output_fields=["id", "content"], limit=limit)
+        if not res: return []
+        samples = random.sample(res, min(sample_size, len(res)))
+        embeddings = self.get_embeddings([item['content'] for item in samples])
+        return [(item['id'], emb) for item, emb in zip(samples, embeddings) if emb]
+
+    def _measure_self_recall(self, queries, search_params):
+        """返回 (Top1 自召回率 %, 单次搜索延迟列表 秒)"""
+        hits, latencies = 0, []
+        for doc_id, emb in queries:
+            start = time.perf_counter()
+            search_res = self.collection.search(
+                data=[emb], 
+                anns_field="embedding", 
+                param=search_params, 
+                limit=1,
+                output_fields=["id"]
+            )
+            latencies.append(time.perf_counter() - start)
+            if search_res and len(search_res[0]) > 0 and search_res[0][0].id == doc_id:
+                hits += 1
+        return (hits / len(queries)) * 100 if queries else 0.0, latencies
+
     def test_self_recall(self, sample_size=20):
         try:
-            total = self.collection.num_entities
-            if total == 0: return "❌ 库为空，无法测试"
+            if self.collection.num_entities == 0: return "❌ 库为空，无法测试"
+            queries = self._sample_recall_queries(sample_size)
+            if not queries: return "❌ 无法获取数据"
 
-            limit = min(100, total)
-            res = self.collection.query(expr="id > 0", output_fields=["id", "content"], limit=limit)
-            if not res: return "❌ 无法获取数据"
-            
-            samples = random.sample(res, min(sample_size, len(res)))
-            hits = 0
-            for item in samples:
-                doc_id = item['id']
-                content = item['content']
-                emb = self.embedding_client.get_embedding(content)
-                if not emb: continue
-                
-                search_res = self.collection.search(
-                    data=[emb], 
-                    anns_field="embedding", 
-                    param={"metric_type": "L2", "params": {}}, 
-                    limit=1,
-                    output_fields=["id"]
-                )
-                
-                if search_res and len(search_res[0]) > 0:
-                    top1_id = search_res[0][0].id
-                    if top1_id == doc_id:
-                        hits += 1
-            
-            recall_rate = (hits / len(samples)) * 100
-            return f"✅ 召回测试 ({len(samples)}条样本): 准确率 {recall_rate:.1f}%"
+            recall_rate, latencies = self._measure_self_recall(queries, self.search_params(limit=1))
+            avg_ms = sum(latencies) / len(latencies) * 1000
+            return f"✅ 召回测试 ({len(queries)}条样本): 准确率 {recall_rate:.1f}% | {self.index_config['index_type']} 平均延迟 {avg_ms:.1f}ms"
             
         except Exception as e:
-            return f"❌ 测试出错: {e}"
\ No newline at end of file
+            return f"❌ 测试出错: {e}"
+
+    def recall_latency_report(self, index_configs=None, sample_size=20):
+        """
+        召回率-延迟报告：对若干索引/搜索参数组合测量 Top1 自召回率与搜索延迟，返回 Markdown 表格。
+        index_configs 为空时只扫描当前索引的搜索参数；包含其他索引类型时会依次重建，结束后恢复原索引
+        """
+        try:
+            if self.collection.num_entities == 0: return "❌ 库为空，无法测试"
+            queries = self._sample_recall_queries(sample_size)
+            if not queries: return "❌ 无法获取数据"
+
+            original = self.index_config
+            configs = [resolve_index_config(c, self.uri) for c in index_configs] if index_configs else [original]
+            lines = [
+                f"召回率-延迟报告 ({len(queries)}条样本)",
+                "| 索引 | 构建参数 | 搜索参数 | Top1召回 | p50(ms) | p95(ms) |",
+                "|---|---|---|---|---|---|",
+            ]
+            try:
+                for config in configs:
+                    if config != self.index_config:
+                        self.rebuild_index(config)
+                    for sweep in INDEX_SEARCH_SWEEPS[config["index_type"]]:
+                        params = {"metric_type": "L2", "params": sweep}
+                        recall_rate, latencies = self._measure_self_recall(queries, params)
+                        latencies.sort()
+                        p50 = latencies[len(latencies) // 2] * 1000
+                        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+                        lines.append(f"| {config['index_type']} | {config['params']} | {sweep} | {recall_rate:.1f}% | {p50:.1f} | {p95:.1f} |")
+            finally:
+                if self.index_config != original:
+                    self.rebuild_index(original)
+            metrics = self.retrieval_metrics()
+            if metrics["queries"]:
+                lines.append(f"\n问答检索 ({metrics['queries']}次): 平均回表 {metrics['avg_content_rows']} 行正文 / {metrics['avg_id_rows']} 行主键 | "
+                             f"延迟 p50 {metrics['latency']['p50']*1000:.0f}ms / p95 {metrics['latency']['p95']*1000:.0f}ms | "
+                             f"取正文 p50 {metrics['hydrate_latency']['p50']*1000:.0f}ms, 正文缓存命中率 {metrics['chunk_cache']['hit_rate']*100:.0f}%")
+            return "\n".join(lines)
+
+        except Exception as e:
+            return f"❌ 测试出错: {e}"